@@ -1,226 +1,266 @@
 import streamlit as st
 import asyncio
-import sys
-import json
-from playwright.async_api import async_playwright
-from tqdm.asyncio import tqdm
-import nest_asyncio
-import subprocess
-from collections import defaultdict
-
-
-# Load towers from JSON
-with open("towers.json", "r") as f:
-    towers = json.load(f)  # Expects a dict {tower_id: tower_name}
-
-
-# Ensure Playwright is installed and necessary browsers are available
-try:
-    import playwright
-except ImportError:
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "playwright"])
-
-# Install the necessary browser binaries
-subprocess.check_call([sys.executable, "-m", "playwright", "install"])
-
-if sys.platform == "win32":
-    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-nest_asyncio.apply()
-
-# Define constants
-default_bge = "BDCD"
-
-heroes = {
-    "Samael": "gmQAA",
-    "Tarian the Lich Lord": "4!fAA",
-    "Groc the Hammer": "QXvAA",
-    "Rayne the Wavecrasher": "Yf0AA",
-    "Orgoth the Hex Fist": "gn5AA",
-    "Ol' Cedric": "ov!AA",
-    "Oda the Aegis": "w3DBA",
-    "Yuriel the Manashifter": "4~IBA",
-    "Aria the Nightwielder": "AIOBA",
-    "Decim the Pyrokinetic": "IQTBA",
-    "Elyse the Truestriker": "QYYBA",
-    "General Ursurio": "YgdBA",
-    "Scyer the Fury Mecha": "goiBA"
-}
-
-def replace_hero(deck_hash, new_hero_hash):
-    """Replace the hero in the deck hash with the new hero hash."""
-    return new_hero_hash + deck_hash[5:]
-
-async def load_page_with_retry(page, url, retries=3):
-    attempt = 0
-    while attempt < retries:
-        try:
-            await page.goto(url, timeout=100000)
-            return True
-        except Exception:
-            attempt += 1
-    return False
-
-
-async def run_simulation(attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type, context):
-    if battle_type == "Tower Battles":
-        url = f"https://vuzaldo.github.io/SIMSpellstone/Titans.html?deck1={attack_deck}&deck2={defense_deck}&mission_level=7&raid_level=25&siege&tower_level=18&tower_type={tower_type}&bges={BGE}&sims={numb_sims}&autostart"
-    elif battle_type == "Arena":
-        url = f"https://vuzaldo.github.io/SIMSpellstone/Titans.html?deck1={attack_deck}&deck2={defense_deck}&mission_level=7&raid_level=25&bges={BGE+"JI"}&sims={numb_sims}&autostart"
-    page = await context.new_page()
+import time
+import uuid
 
-    try:
-        success = await load_page_with_retry(page, url)
-        if not success:
-            return None
-        if await page.query_selector("#winrate"):
-            winrate = await page.inner_text("#winrate")
-            return winrate.strip()
-        return None
-    except Exception:
-        return None
-    finally:
-        await page.close()
+from bootstrap import bootstrap
+from deck_hash import decode, decode_unit, removal_variants, split_units
+from engine import default_bge
+from jobs import get_job_manager
+from metrics import get_metrics
+from opponents import cluster, parse_opponents
 
 
-async def simulate_pair(pair, battle_type, numb_sims, BGE, tower_type, context, semaphore, pbar):
-    async with semaphore:
-        attack_deck, defense_deck = pair
-        result = await run_simulation(attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type, context)
-        pbar.update(1)
-        return (attack_deck, defense_deck, result)
-
+st.set_page_config(layout="wide")  # Ensure full-width layout
 
-async def run_simulations_parallel(attack_decks, defense_decks, battle_type, numb_sims, BGE, tower_type):
-    deck_pairs = [(attack_deck, defense_deck) for attack_deck in attack_decks for defense_deck in defense_decks]
-    total_simulations = len(deck_pairs)
-    semaphore = asyncio.Semaphore(8)
+# Browser check, towers.json etc. only run on the first script run of the process
+_bootstrap_start = time.perf_counter()
+startup = bootstrap()
+towers = startup.towers
+_bootstrap_seconds = time.perf_counter() - _bootstrap_start
 
-    with tqdm(total=total_simulations, desc="Simulations Progress", unit="sim") as pbar:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True, args=["--disable-gpu", "--no-sandbox"])
-            context = await browser.new_context()
-            tasks = [simulate_pair(pair, battle_type, numb_sims, BGE, tower_type, context, semaphore, pbar) for pair in deck_pairs]
-            results = await asyncio.gather(*tasks)
-            await browser.close()
+# Optimizations run as background jobs shared by every session of this server
+jobs = get_job_manager()
+JOB_POLL_SECONDS = 1.0
 
-    return results
 
+def show_race_budget(race_result):
+    """Tell the user how many sims racing skipped."""
+    if race_result is not None:
+        st.caption(f"Racing ran {race_result.sims_used:,} of {race_result.sims_budget:,} sims ({race_result.saved:.0%} saved). "
+                   "Candidates marked * were dropped early and have less precise winrates.")
 
-async def get_card_name_from_hash(card_hash, context):
-    # This function fetches the card name using the hash on the website
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)  # Set False if you want to see the browser
-        page = await browser.new_page()
 
-        # Open the DeckBuilder website
-        await page.goto("https://vuzaldo.github.io/SIMSpellstone/DeckBuilder.html")
-        await page.wait_for_load_state("domcontentloaded")
+def race_marker(race_result, deck):
+    if race_result is not None and race_result.eliminated.get(deck) is not None:
+        return "*"
+    return ""
 
-        js_script = f"""
-        (() => {{
-            // Decode the hash to get deck info
-            var d = hash_decode("{card_hash}");
 
-            // Extract the ID from the first card in the deck
-            var card_id = d.deck[0].id;
-            var rune_id = d.deck[0].runes[0].id;  // FIXED: use 'd' instead of 'c'
+def format_winrate(winrate):
+    return f"**{winrate:.2f}%**" if winrate is not None else "**no result**"
 
-            var cardName = "";
-            var cardRune = "";
 
-            // Check if CARDS is available and search for the card name
-            Object.values(CARDS).forEach(c => {{
-                if (c.id == card_id) {{
-                    cardName = c.name;
-                }}
-            }});
+def ranking_text(labels, winrates, deck_type):
+    """Candidates with results so far, best first."""
+    ranked = sorted((deck for deck in labels if winrates.get(deck) is not None),
+                    key=winrates.get, reverse=deck_type == "Offence")
+    return "\n".join(f"{place}. `{labels[deck]}` → **{winrates[deck]:.2f}%**" for place, deck in enumerate(ranked, 1))
 
-            // Check if RUNES is available and search for the rune name
-            
-            Object.values(RUNES).forEach(c => {{
-                if (c.id == rune_id) {{
-                    cardRune = c.name;
-                }}
-            }});
 
-            return [cardName, cardRune];  // FIXED: Return an array instead of tuple
-        }})()
-        """
+def watcher_id():
+    """Identifies this browser session to the job manager, so Stop only drops our interest in a shared job."""
+    if "watcher" not in st.session_state:
+        st.session_state["watcher"] = uuid.uuid4().hex
+    return st.session_state["watcher"]
 
-        # Get the card name by executing the JavaScript code
-        card_name, card_rune = await page.evaluate(js_script)
 
-        # Close the page and return the result
-        await page.close()
-        return [card_name, card_rune]
+def show_in_columns(winrate_text, split):
+    # Split the list into two halves for two columns
+    column_1 = winrate_text[:split]
+    column_2 = winrate_text[split:]
 
+    # Create two columns for display
+    col1, col2 = st.columns(2)
 
-async def optimize_deck(your_deck, opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, context):
+    with col1:
+        # Display the first half of the winrate_text list
+        for text in column_1:
+            st.write(text)
 
-    if deck_type == "Defence":
-        attack_decks = opponents_decks
-        defence_deck = your_deck
-        len_hash = len(defence_deck)
-        card_hashes = [defence_deck[i:i + 5] for i in range(5, len_hash, 5)]  # Assuming 5-char card hashes
-    elif deck_type == 'Offence':
-        defence_decks = opponents_decks
-        attack_deck = your_deck
-        len_hash = len(attack_deck)
-        card_hashes = [attack_deck[i:i + 5] for i in range(5, len_hash, 5)]  # Assuming 5-char card hashes
-    seen_card_hashes = set()
-    modified_decks = []
-    removed_names = []
-    removed_runes = []
-
-    # Fetch card names for each hash in `card_hashes`
-    card_names = {}
-    card_runes = {}
-    for card_hash in card_hashes:
-        if card_hash in seen_card_hashes:
-            continue
-        seen_card_hashes.add(card_hash)
-        card_name, card_rune = await get_card_name_from_hash(card_hash, context)
-        card_names[card_hash] = card_name
-        card_runes[card_hash] = card_rune
-        if deck_type == "Defence":
-            modified_deck = defence_deck.replace(card_hash, "", 1)
-        elif deck_type == "Offence":
-            modified_deck = attack_deck.replace(card_hash, "", 1)
-        modified_decks.append(modified_deck)
-        removed_names.append(card_name)  # Store card names
-        removed_runes.append(card_rune)
+    with col2:
+        # Display the second half of the winrate_text list
+        for text in column_2:
+            st.write(text)
 
 
+def show_card_results(job):
+    avg_winrate, avg_winrates, removed_names, removed_runes, race_result = job.result
+    deck_type = job.params["deck_type"]
+    st.write(f"**Winrate of Current Deck:** {format_winrate(avg_winrate)}")
 
+    st.subheader("Winrates After Removing Each Card")
+    if deck_type == "Defence":
+        st.caption("High winrate equals a good card was removed.")
+    if deck_type == "Offence":
+        st.caption("Low winrate equals a good card was removed.")
+    show_race_budget(race_result)
+
+    # Create a list of strings with each card and winrate on a new line
+    removed_decks = [deck for _, deck in removal_variants(job.params["deck"])]
+    winrate_text = [
+        f"`{name} ({rune})`{race_marker(race_result, deck)} → {format_winrate(avg_winrates[deck])}"
+        for name, rune, deck in zip(removed_names, removed_runes, removed_decks)
+    ]
+    show_in_columns(winrate_text, 8)
+
+
+def show_hero_results(job):
+    hero_decks, hero_result = job.result
+    deck_type = job.params["deck_type"]
+    st.subheader("Best Hero")
+    if deck_type == "Defence":
+        st.caption("Low winrate equals a good hero.")
+    if deck_type == "Offence":
+        st.caption("High winrate equals a good hero.")
+    show_race_budget(hero_result.race)
+    winrate_text = [
+        f"`{name}`{race_marker(hero_result.race, deck)} → {format_winrate(hero_result.winrates[deck])}"
+        for name, deck in hero_decks.items()
+    ]
+    show_in_columns(winrate_text, 7)
+
+
+def show_replacement_results(job):
+    card_info, card_decks, replacement_result = job.result
+    deck_type = job.params["deck_type"]
+    st.subheader("Winrates of Replacement Cards")
     if deck_type == "Defence":
-        initial_results = await run_simulations_parallel(attack_decks, [your_deck], battle_type, numb_sims, BGE, tower_type)
-        winrates = [float(result[2].strip('%')) for result in initial_results if result[2]]
-        results = await run_simulations_parallel(attack_decks, modified_decks, battle_type, numb_sims, BGE, tower_type)
-    elif deck_type == "Offence":
-        initial_results = await run_simulations_parallel([your_deck], defence_decks, battle_type, numb_sims, BGE, tower_type)
-        winrates = [float(result[2].strip('%')) for result in initial_results if result[2]]
-        results = await run_simulations_parallel(modified_decks, defence_decks, battle_type, numb_sims, BGE, tower_type)
-    avg_winrate = sum(winrates) / len(winrates) if winrates else 0
+        st.caption("Low winrate equals a good replacement card.")
+    if deck_type == "Offence":
+        st.caption("High winrate equals a good replacement card.")
+    show_race_budget(replacement_result.race)
+
+    # Create a list of strings with each card and winrate on a new line
+    winrate_text = []
+    for card_hash, deck in card_decks.items():
+        card_name, card_rune = card_info.get(card_hash, (card_hash, card_hash))
+        winrate = replacement_result.winrates[deck]
+        winrate_text.append(f"`{card_name} ({card_rune})`{race_marker(replacement_result.race, deck)} → {format_winrate(winrate)}")
+    show_in_columns(winrate_text, 8)
+
+
+def show_swap_results(job):
+    swap_result = job.result
+    st.subheader("Best Swaps")
+    st.write(f"**Winrate of Current Deck:** {format_winrate(swap_result.baseline)}")
+    st.caption(f"{swap_result.simulated} of {swap_result.considered} possible swaps were simulated; "
+               "the rest were ruled out by the single-card scores.")
+    if not swap_result.swaps:
+        st.write("No swap could be scored.")
+    for place, swap in enumerate(swap_result.swaps, 1):
+        label = job.labels.get(swap.deck, f"{' + '.join(swap.removed)} → {' + '.join(swap.added)}")
+        st.write(f"{place}. `{label}` → {format_winrate(swap.winrate)} (predicted {swap.estimate:.2f}%)")
+        st.code(swap.deck, language=None)
+
+
+def show_config_results(job):
+    sweep_result = job.result
+    deck_type = job.params["deck_type"]
+    names = job.params["config_names"]
+    st.subheader("Winrates per Configuration")
+    st.caption("Overall is the weighted average over the configurations. " +
+               ("Low winrates are better." if deck_type == "Defence" else "High winrates are better."))
+    overall = sweep_result.overall
+    ranked = sorted((deck for deck in job.labels if overall.get(deck) is not None), key=overall.get, reverse=deck_type == "Offence")
+    ranked += [deck for deck in job.labels if overall.get(deck) is None]
+    rows = []
+    for deck in ranked:
+        row = {"candidate": job.labels[deck]}
+        for name, winrates in zip(names, sweep_result.winrates):
+            row[name] = None if winrates.get(deck) is None else round(winrates[deck], 2)
+        row["overall"] = None if overall.get(deck) is None else round(overall[deck], 2)
+        rows.append(row)
+    st.dataframe(rows, hide_index=True)
+    st.subheader("Overall Ranking")
+    st.markdown(ranking_text(job.labels, overall, deck_type))
+
+
+RESULT_VIEWS = {"cards": show_card_results, "hero": show_hero_results, "replacement": show_replacement_results,
+                "swap": show_swap_results, "configs": show_config_results}
+
+
+def show_job(job):
+    """Progress while the job runs, the results once it's done."""
+    st.caption(f"Job `{job.id}` - open this page with `?job={job.id}` to come back to it later.")
+    deck_type = job.params["deck_type"]
+    if job.status == "queued":
+        st.info(f"Waiting for a free slot ({jobs.queue_position(job)} in line)...")
+    elif job.status == "running":
+        if job.total:
+            st.progress(job.done / job.total, text=f"{job.done} of {job.total} matchups done")
+        else:
+            st.progress(0.0, text="Waiting for the first results...")
+        st.markdown(ranking_text(job.labels, job.winrates, deck_type))
+    elif job.status == "cancelled":
+        st.subheader("Stopped Early")
+        st.caption(f"{job.done} of {job.total} matchups were done.")
+        st.markdown(ranking_text(job.labels, job.winrates, deck_type))
+    elif job.status == "failed":
+        st.error(f"The optimization failed: {job.error}")
+    else:
+        RESULT_VIEWS[job.kind](job)
+
+
+def show_metrics():
+    """Where the time goes and what fails, since this server started."""
+    metrics = get_metrics()
+    with st.expander("Metrics"):
+        spans = metrics.spans()
+        counters = metrics.counters()
+        if not spans and not counters:
+            st.write("Nothing simulated yet.")
+            return
+        st.caption("This server process only; sharded worker processes report through SPELLSTONE_METRICS_FILE.")
+        st.table([{"step": name + "".join(f" ({value})" for value in labels.values()), "calls": stats.count, "errors": stats.errors,
+                   "mean s": round(stats.total / stats.count, 3), "max s": round(stats.max, 3)}
+                  for name, labels, stats in spans])
+        if counters:
+            st.table([{"counter": name, "cause": ", ".join(f"{key}={value}" for key, value in labels.items()), "count": value}
+                      for name, labels, value in counters])
+
+
+def read_opponents(text, files, merge_distance=0):
+    """Opponents from the text area and uploaded files, deduped (and clustered if merge_distance > 0)."""
+    texts = [text] + [file.getvalue().decode("utf-8", errors="replace") for file in files or []]
+    opponent_set = parse_opponents("\n".join(texts))
+    if merge_distance:
+        opponent_set = cluster(opponent_set, merge_distance)
+    return opponent_set
+
+
+def parse_sims(text):
+    """Number of Simulations as a positive int, None if it isn't one."""
+    try:
+        sims = int(str(text).strip())
+    except ValueError:
+        return None
+    return sims if sims > 0 else None
+
+
+def parse_card_hashes(text):
+    """Replacement card hashes as a list, None unless every 5-char unit decodes to a card."""
+    try:
+        units = split_units(text.strip())
+        for unit in units:
+            decode_unit(unit)
+    except ValueError:
+        return None
+    return list(units)
 
-    avg_winrates = {}
-    for i, modified_deck in enumerate(modified_decks):
-        if deck_type == "Defence":
-            total_winrate = sum(
-                float(winrate.strip('%')) for attack, defense, winrate in results if defense == modified_deck and winrate)
-            avg_winrates[removed_names[i]] = total_winrate / len(attack_decks)
-        elif deck_type == "Offence":
-            total_winrate = sum(
-                float(winrate.strip('%')) for attack, defense, winrate in results if attack == modified_deck and winrate)
-            avg_winrates[removed_names[i]] = total_winrate / len(defence_decks)
 
-    return avg_winrate, avg_winrates, removed_names, removed_runes
+def parse_deck(text):
+    """The deck hash without surrounding whitespace, None if it doesn't decode to a hero and cards."""
+    try:
+        deck = decode(text.strip())
+    except ValueError:
+        return None
+    return text.strip() if deck.cards else None
 
 
-async def run_optimization(attack_decks, defense_deck_hash, deck_type, battle_type, numb_sims, BGE, tower_type, context):
-    return await optimize_deck(attack_decks, defense_deck_hash, deck_type, battle_type, numb_sims, BGE, tower_type, context)
+def show_opponent_summary(opponent_set):
+    if opponent_set.errors:
+        st.warning(f"Skipped {len(opponent_set.errors)} line(s) that aren't deck hashes: " +
+                   ", ".join(f"`{line}`" for line in opponent_set.errors[:5]))
+    if opponent_set.decks and opponent_set.total_weight != len(opponent_set.decks):
+        st.caption(f"{opponent_set.total_weight:g} opponent decks → {len(opponent_set.decks)} to simulate, weighted to match.")
 
 
-st.set_page_config(layout="wide")  # Ensure full-width layout
+def show_startup_timings():
+    with st.expander("Startup timings"):
+        for step, seconds in list(startup.timings.items()):
+            st.write(f"{step}: {seconds:.2f}s")
+        st.write(f"this run's startup lookup: {_bootstrap_seconds * 1000:.1f}ms")
 
 
 async def main():
@@ -234,12 +274,30 @@ async def main():
         your_deck_hash = st.text_input("Your Deck")
         st.caption("Provide a deck hash with 1 card removed, when you try to find a replacemnt card for your deck.")
         opponents_decks_input = st.text_area("Decks of opponents (one hash per line)")
+        opponent_files = st.file_uploader("Or import opponent lists", type=["txt", "csv"], accept_multiple_files=True,
+                                          help="One deck hash per line, optionally followed by a weight: `hash 3` or `hash,3`.")
+        o1, o2 = st.columns(2)
+        with o1:
+            merge_similar = st.checkbox("Merge near-identical opponents", help="Decks that differ by only a few cards "
+                                        "(or just the hero) are simulated once and weighted by how many they stand for.")
+        with o2:
+            merge_distance = st.number_input("Cards different", min_value=1, max_value=5, value=1, disabled=not merge_similar)
+        opponent_set = read_opponents(opponents_decks_input, opponent_files, merge_distance if merge_similar else 0)
+        show_opponent_summary(opponent_set)
         replacement_card_hash = st.text_input("Hashes of Replacement cards")
         a1, a2 = st.columns(2)
         with a1:
             numb_sims = st.text_input("Number of Simulations:", value=10000)
         with a2:
             BGE = st.text_input("BGE:", value=default_bge)
+        sim_length = st.radio("Simulation length", ["Fixed number of sims", "Target precision"], horizontal=True)
+        precision = None
+        if sim_length == "Target precision":
+            precision = st.number_input("Target precision (± winrate %)", min_value=0.1, value=1.0, step=0.1,
+                                        help="Runs on a single browser process: stopping once the ranking is clear needs "
+                                             "every result in one place, so SPELLSTONE_WORKERS doesn't apply. Racing does shard.")
+            st.caption("Each matchup stops once its winrate is known this precisely, or when the ranking is clear. Number of Simulations becomes the upper limit.")
+        racing = st.checkbox("Racing: drop clearly worse candidates early", help="Cheap rounds first; only the best candidates get the full Number of Simulations. Overrides target precision.")
         b1, b2, b3 = st.columns(3)
         with b1:
             deck_type = st.radio("What deck do you want to optimze?", ["Offence", "Defence"])
@@ -259,232 +317,101 @@ async def main():
             run_button_hero = st.button("Run Hero Optimization")
         with c3:
             run_button_replacement = st.button("Find Replacement")
+        d1, d2, d3 = st.columns(3)
+        with d1:
+            swap_size = st.number_input("Cards to swap", min_value=1, max_value=2, value=1)
+        with d2:
+            top_k = st.number_input("Swaps to show", min_value=1, max_value=20, value=5)
+        with d3:
+            run_button_swap = st.button("Find Best Swaps", help="Swap cards of your full deck for the replacement cards. "
+                                        "Single-card scores rule out unpromising swaps before they're simulated.")
+        with st.expander("Sweep several towers and BGEs"):
+            if battle_type == "Arena":
+                sweep_towers = [selected_tower_name]
+                st.caption("Arena battles have no tower, so only the BGEs are swept.")
+            else:
+                sweep_towers = st.multiselect("Towers", tower_names, default=[selected_tower_name])
+            sweep_bges = [bge.strip() for bge in st.text_input("BGEs (comma separated)", value=BGE).split(",") if bge.strip()]
+            sweep_grid = [{"tower": tower_name, "BGE": bge, "weight": 1.0} for tower_name in sweep_towers for bge in sweep_bges]
+            if sweep_grid:
+                sweep_grid = st.data_editor(sweep_grid, disabled=["tower", "BGE"], hide_index=True,
+                                            key="sweep_weights_" + "|".join(sweep_towers + sweep_bges))
+            sweep_flow = st.radio("Candidates", ["Cards", "Hero", "Replacement"], horizontal=True)
+            run_button_configs = st.button("Sweep Configurations", help="Run every candidate against every opponent under "
+                                           "each tower and BGE in one batch. Racing doesn't apply here.")
+        stop_button = st.button("Stop", help="Stop the running optimization and keep the results so far. A job other users are also waiting on keeps running for them.")
+        show_startup_timings()
+        show_metrics()
 
     # Results (Right side)
     with col2:
         st.header("Results")
 
-        if run_button_cards:
-            if not opponents_decks_input or not your_deck_hash:
+        if run_button_cards or run_button_hero or run_button_replacement or run_button_swap or run_button_configs:
+            sims = parse_sims(numb_sims)
+            needs_cards = run_button_replacement or run_button_swap or (run_button_configs and sweep_flow == "Replacement")
+            replacement_cards = parse_card_hashes(replacement_card_hash) if needs_cards else []
+            deck = parse_deck(your_deck_hash)
+            if not opponent_set.decks or not your_deck_hash:
                 st.error("Please enter both attack deck hashes and a defense deck hash.")
+            elif deck is None:
+                st.error("Your Deck isn't a valid deck hash: a hero and cards, 5 characters each.")
+            elif run_button_configs and not sweep_grid:
+                st.error("Please select at least one tower and one BGE to sweep.")
+            elif sims is None:
+                st.error(f"Number of Simulations must be a whole number above 0, not `{numb_sims}`.")
+            elif needs_cards and not replacement_cards:
+                st.error("Please enter the replacement card hashes: 5 characters per card, nothing in between.")
+            elif run_button_configs and any(row["weight"] is None or row["weight"] < 0 for row in sweep_grid):
+                st.error("Every sweep weight must be a number of 0 or more.")
             else:
-                opponents_decks = [line.strip() for line in opponents_decks_input.split("\n") if line.strip()]
-
-
-                with st.spinner("Running simulations... this may take a while."):
-
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-
-                    # Pass context into the optimization function
-                    async with async_playwright() as p:
-                        browser = await p.chromium.launch(headless=True, args=["--disable-gpu", "--no-sandbox"])
-                        context = await browser.new_context()
-
-                        avg_winrate, avg_winrates, removed_names, removed_runes = await run_optimization(your_deck_hash, opponents_decks, deck_type, battle_type, numb_sims, BGE, selected_tower_id, context)
-
-                        await browser.close()
-
-                    # Store results in session state
-                    st.session_state["avg_winrate"] = avg_winrate
-                    st.session_state["avg_winrates"] = avg_winrates
-                    st.session_state["removed_names"] = removed_names
-                    st.session_state["removed_runes"] = removed_runes
-
-            # Display results if available
-            if "avg_winrate" in st.session_state:
-                st.write(f"**Winrate of Current Deck:** {st.session_state['avg_winrate']:.2f}%")
-
-                st.subheader("Winrates After Removing Each Card")
-                if deck_type == "Defence":
-                    st.caption("High winrate equals a good card was removed.")
-                if deck_type == "Offence":
-                    st.caption("Low winrate equals a good card was removed.")
-
-                # Create a list of strings with each card and winrate on a new line
-                winrate_text = [
-                    f"`{name} ({rune})` → **{winrate:.2f}%**"
-                    for name, rune, winrate in zip(
-                        st.session_state["removed_names"], st.session_state["removed_runes"], st.session_state["avg_winrates"].values()
-                    )
-                ]
-
-                # Split the list into two halves for two columns
-                column_1 = winrate_text[:8]
-                column_2 = winrate_text[8:]
-
-                # Create two columns for display
-                col1, col2 = st.columns(2)
-
-                with col1:
-                    # Display the first half of the winrate_text list
-                    for text in column_1:
-                        st.write(text)
-
-                with col2:
-                    # Display the second half of the winrate_text list
-                    for text in column_2:
-                        st.write(text)
-
-        if run_button_hero:
-            if not opponents_decks_input or not your_deck_hash:
-                st.error("Please enter both attack deck hashes and a defense deck hash.")
-            else:
-                opponents_decks = [line.strip() for line in opponents_decks_input.split("\n") if line.strip()]
-
-                with st.spinner("Running simulations... this may take a while."):
-
-
-                    your_deck = [replace_hero(your_deck_hash, hero_hash) for hero_hash in heroes.values()]
-
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-
-                    async with async_playwright() as p:
-                        browser = await p.chromium.launch(headless=True, args=["--disable-gpu", "--no-sandbox"])
-                        context = await browser.new_context()
-
-                        hero_names = list(heroes.keys())
-
-                        if deck_type == "Defence":
-                            results = await run_simulations_parallel( opponents_decks, your_deck, battle_type, numb_sims, BGE, selected_tower_id)
-                            # Dictionary to store win rates for each defense deck
-                            winrate_dict = defaultdict(list)
-
-                            # Populate the dictionary
-                            for attack_deck, defense_deck, winrate in results:
-                                winrate_dict[defense_deck].append(float(winrate.strip('%')))
-
-                            # Compute the average win rate for each defense deck
-                            average_winrates = {deck: sum(rates) / len(rates) for deck, rates in winrate_dict.items()}
-
-                        elif deck_type == "Offence":
-                            results = await run_simulations_parallel(your_deck, opponents_decks, battle_type, numb_sims, BGE, selected_tower_id)
-                            winrate_dict = defaultdict(list)
-
-                            # Populate the dictionary
-                            for attack_deck, defense_deck, winrate in results:
-                                winrate_dict[attack_deck].append(float(winrate.strip('%')))
-
-                            # Compute the average win rate for each attack deck
-                            average_winrates = {deck: sum(rates) / len(rates) for deck, rates in winrate_dict.items()}
-
-                        await browser.close()
-
-            st.subheader("Best Hero")
-            if deck_type == "Defence":
-                st.caption("Low winrate equals a good hero.")
-            if deck_type == "Offence":
-                st.caption("High winrate equals a good hero.")
-            winrate_text = [
-                f"`{name}` → **{winrate:.2f}%**"
-                for name, winrate in zip(hero_names,average_winrates.values())
-            ]
-            # Split the list into two halves for two columns
-            column_1 = winrate_text[:7]
-            column_2 = winrate_text[7:]
-
-            # Create two columns for display
-            col1, col2 = st.columns(2)
-
-            with col1:
-                # Display the first half of the winrate_text list
-                for text in column_1:
-                    st.write(text)
-
-            with col2:
-                # Display the second half of the winrate_text list
-                for text in column_2:
-                    st.write(text)
-
-        if run_button_replacement:
-            if not opponents_decks_input or not your_deck_hash:
-                st.error("Please enter both attack deck hashes and a defense deck hash.")
-            else:
-                card_hashes = [replacement_card_hash[i:i + 5] for i in range(0, len(replacement_card_hash), 5)]
-                your_decks = [your_deck_hash + card for card in card_hashes]
-                opponents_decks = [line.strip() for line in opponents_decks_input.split("\n") if line.strip()]
-
-                with st.spinner("Running simulations... this may take a while."):
-
-
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-
-                    async with async_playwright() as p:
-                        browser = await p.chromium.launch(headless=True, args=["--disable-gpu", "--no-sandbox"])
-                        context = await browser.new_context()
-
-                        card_names = {}
-                        card_runes = {}
-                        for card_hash in card_hashes:
-                            card_name, card_rune = await get_card_name_from_hash(card_hash, context)
-                            card_names[card_hash] = card_name
-                            card_runes[card_hash] = card_rune
-
-
-                        if deck_type == "Defence":
-                            results = await run_simulations_parallel(opponents_decks, your_decks, battle_type, numb_sims, BGE, selected_tower_id)
-                            # Dictionary to store win rates for each defense deck
-                            winrate_dict = defaultdict(list)
-
-                            # Populate the dictionary
-                            for attack_deck, defense_deck, winrate in results:
-                                winrate_dict[defense_deck].append(float(winrate.strip('%')))
-
-                            # Compute the average win rate for each defense deck
-                            average_winrates = {deck: sum(rates) / len(rates) for deck, rates in winrate_dict.items()}
-
-                        elif deck_type == "Offence":
-                            results = await run_simulations_parallel(your_decks, opponents_decks, battle_type, numb_sims, BGE, selected_tower_id)
-                            winrate_dict = defaultdict(list)
-
-                            # Populate the dictionary
-                            for attack_deck, defense_deck, winrate in results:
-                                winrate_dict[attack_deck].append(float(winrate.strip('%')))
-
-                            # Compute the average win rate for each attack deck
-                            average_winrates = {deck: sum(rates) / len(rates) for deck, rates in winrate_dict.items()}
-
-                        await browser.close()
-
-
-                        st.subheader("Winrates of Replacement Cards")
-                        if deck_type == "Defence":
-                            st.caption("Low winrate equals a good replacement card.")
-                        if deck_type == "Offence":
-                            st.caption("High winrate equals a good replacement card.")
-
-                        st.session_state["avg_winrates"] = average_winrates
-                        st.session_state["card_names"] = card_names
-                        st.session_state["card_runes"] = card_runes
-
-                        # Create a list of strings with each card and winrate on a new line
-                        winrate_text = []
-                        for full_deck_hash, winrate in st.session_state["avg_winrates"].items():
-                            replaced_card_hash = full_deck_hash[-5:]  # Assumes the replaced card is at the end
-                            card_name = st.session_state["card_names"].get(replaced_card_hash, replaced_card_hash)
-                            card_rune = st.session_state["card_runes"].get(replaced_card_hash, replaced_card_hash)
-                            winrate_text.append(f"`{card_name} ({card_rune})` → **{winrate:.2f}%**")
-
-                        # Split the list into two halves for two columns
-                        column_1 = winrate_text[:8]
-                        column_2 = winrate_text[8:]
-
-                        # Create two columns for display
-                        col1, col2 = st.columns(2)
-
-                        with col1:
-                            # Display the first half of the winrate_text list
-                            for text in column_1:
-                                st.write(text)
-
-                        with col2:
-                            # Display the second half of the winrate_text list
-                            for text in column_2:
-                                st.write(text)
-
+                params = {"deck": deck, "opponents": opponent_set.decks, "deck_type": deck_type, "battle_type": battle_type,
+                          "numb_sims": sims, "BGE": BGE, "tower_type": selected_tower_id, "precision": precision, "racing": racing,
+                          "weights": opponent_set.weights}
+                if run_button_cards:
+                    kind = "cards"
+                elif run_button_hero:
+                    kind = "hero"
+                elif run_button_replacement:
+                    kind = "replacement"
+                    params["cards"] = replacement_cards
+                elif run_button_swap:
+                    kind = "swap"
+                    params.update(cards=replacement_cards, swap_size=int(swap_size), top_k=int(top_k))
+                else:
+                    # One tower and BGE per row of the sweep grid instead of the single ones above
+                    kind = "configs"
+                    for key in ("BGE", "tower_type", "racing"):
+                        del params[key]
+                    params.update(flow=sweep_flow.lower(), configs=[[tower_ids[tower_names.index(row["tower"])], row["BGE"]] for row in sweep_grid],
+                                  config_names=[row["BGE"] if battle_type == "Arena" else f"{row['tower']} / {row['BGE']}"
+                                                for row in sweep_grid],
+                                  config_weights=[float(row["weight"]) for row in sweep_grid])
+                    if params["flow"] == "replacement":
+                        params["cards"] = replacement_cards
+                job_id = jobs.submit(kind, params, watcher_id())
+                st.session_state["job_id"] = job_id
+                st.session_state.pop("stopped_job_id", None)
+                st.query_params["job"] = job_id
+
+        # A reload (or a shared link) picks the job back up from the URL
+        job_id = st.session_state.get("job_id") or st.query_params.get("job")
+        if stop_button and job_id:
+            jobs.cancel(job_id, watcher_id())
+            st.session_state["stopped_job_id"] = job_id
+
+        job = jobs.get(job_id) if job_id else None
+        if job_id and job is None:
+            st.warning(f"Job `{job_id}` is no longer available.")
+        elif job is not None:
+            # Also makes a session that reopened the job through ?job= one of its watchers
+            if st.session_state.get("stopped_job_id") != job_id:
+                jobs.watch(job_id, watcher_id())
+            show_job(job)
+            if job.active:
+                time.sleep(JOB_POLL_SECONDS)
+                st.rerun()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
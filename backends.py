@@ -0,0 +1,334 @@
+"""Where matchups get simulated.
+
+SPELLSTONE_BACKEND picks one of:
+
+- "remote" (default): SIMSpellstone on GitHub Pages, driven by the browser pool.
+- "local": the same pages from a local copy of the SIMSpellstone site.
+  Set SPELLSTONE_SIMULATOR_DIR to the copy's directory (it's served on a
+  local HTTP port) or SPELLSTONE_SIMULATOR_URL to where it already lives
+  (an http:// or file:// URL of the directory holding Titans.html).
+- "mock": no browser at all. Winrates are synthetic but deterministic, for
+  benchmarking the pipeline and testing without network access.
+  SPELLSTONE_MOCK_LATENCY adds a delay in seconds to every run.
+
+Every backend returns the winrate as the text #winrate would show, e.g. "55.23%".
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import weakref
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlencode
+
+from browser_pool import DEFAULT_POOL_SIZE, get_pool
+from metrics import get_metrics
+
+
+REMOTE_SITE_URL = "https://vuzaldo.github.io/SIMSpellstone/"
+PAGE_TIMEOUT = 100000  # ms
+
+# Form fields a warm run sets when the matchup doesn't: an Arena matchup on a
+# page that last ran a Tower Battle must not inherit its siege and tower
+WARM_FIELD_DEFAULTS = {"siege": False, "tower_level": "", "tower_type": ""}
+
+# The BGE only reaches a warm page through its query string. Before the first
+# warm run, the same matchup is run warm and with a full page load. Winrates
+# further apart than WARM_CHECK_Z standard errors mean the warm run isn't
+# simulating what the URL asks for, and warm mode is turned off.
+WARM_CHECK_SIMS = 2000
+WARM_CHECK_Z = 4
+
+# Runs one matchup inside an already initialized Titans.html page.
+# Returns null when the page doesn't look like the simulator we know,
+# in which case the caller falls back to a full page load.
+WARM_SIM_JS = """
+async (params) => {
+    if (typeof SIM_CONTROLLER === "undefined" || typeof SIM_CONTROLLER.startsim !== "function") {
+        return null;
+    }
+    for (var id of ["deck1", "deck2", "sims"]) {
+        if (!document.getElementById(id)) {
+            return null;
+        }
+    }
+
+    // The simulator reads its settings from the query string, so point it at the new matchup
+    history.replaceState(null, "", location.pathname + "?" + params.query);
+    for (var [id, value] of Object.entries(params.fields)) {
+        var el = document.getElementById(id);
+        if (!el) {
+            continue;
+        }
+        if (el.type === "checkbox") {
+            el.checked = value;
+        } else {
+            el.value = value;
+        }
+    }
+
+    var previous = document.getElementById("winrate");
+    if (previous) {
+        previous.innerText = "";
+    }
+    SIM_CONTROLLER.startsim();
+
+    // Wait until the run has finished and the final winrate is written
+    var deadline = Date.now() + params.timeout;
+    var winrate = document.getElementById("winrate");
+    while (!winrate || winrate.innerText.trim() === "" || (typeof SIMULATOR !== "undefined" && SIMULATOR.simulating)) {
+        if (Date.now() > deadline) {
+            throw new Error("Timed out waiting for #winrate");
+        }
+        await new Promise(resolve => setTimeout(resolve, 20));
+        winrate = document.getElementById("winrate");
+    }
+    return winrate.innerText.trim();
+}
+"""
+
+
+def _percent(text):
+    # "55.23%" -> 55.23; None for no or unreadable winrate
+    try:
+        return float(text.strip().strip("%"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def build_query(params):
+    # Flags like &siege have no value
+    parts = []
+    for key, value in params.items():
+        if value is True:
+            parts.append(key)
+        else:
+            parts.append(urlencode({key: value}, safe="!~,"))
+    return "&".join(parts)
+
+
+async def load_page_with_retry(page, url, retries=3):
+    metrics = get_metrics()
+    for attempt in range(retries):
+        try:
+            with metrics.span("navigation"):
+                await page.goto(url, timeout=PAGE_TIMEOUT)
+            return True
+        except Exception as e:
+            # TimeoutError means a slow page, anything else a broken one
+            if attempt + 1 < retries:
+                metrics.count("navigation_retries", cause=type(e).__name__)
+            else:
+                metrics.count("navigation_failures", cause=type(e).__name__)
+    return False
+
+
+class BrowserBackend:
+    """Runs Titans.html from `site_url` in the browser pool.
+
+    In "warm" mode (SPELLSTONE_SIM_MODE, the default) matchups are submitted
+    to an already loaded page; "url" loads the page with &autostart every time.
+    Warm mode is checked against a full page load once before it's used.
+    """
+
+    has_browser = True
+
+    def __init__(self, site_url, sim_mode="warm", cache_id=None):
+        self.site_url = site_url if site_url.endswith("/") else site_url + "/"
+        self.titans_url = self.site_url + "Titans.html"
+        # Which simulator the cached results came from; a local copy served on a
+        # random port passes its directory so its results survive restarts
+        self.cache_id = cache_id or self.site_url
+        self.sim_mode = sim_mode
+        # Set to False the first time the page doesn't expose what warm mode needs,
+        # so we don't keep probing a page whose JS has changed
+        self.warm_supported = True
+        self.warm_checked = False
+        self._warm_check_lock = None  # asyncio.Lock, made on the pool's loop
+
+    async def run(self, coro):
+        """Run a coroutine that simulates matchups where this backend can reach the pages."""
+        return await get_pool().run(coro)
+
+    async def simulate(self, params):
+        pool = get_pool()
+        return await pool.run(self._run_simulation_page(pool, params))
+
+    def simulation_url(self, params):
+        return f"{self.titans_url}?{build_query(params)}&autostart"
+
+    async def _run_simulation_page(self, pool, params):
+        async with pool.page() as page:
+            if self.sim_mode == "warm" and self.warm_supported and not self.warm_checked:
+                await self._check_warm(page, params)
+            if self.sim_mode == "warm" and self.warm_supported:
+                try:
+                    winrate = await self._run_warm(page, params)
+                    if winrate is not None:
+                        return winrate
+                except Exception as e:
+                    # Fall back to a full page load below
+                    get_metrics().count("warm_fallbacks", cause=type(e).__name__)
+            try:
+                return await self._run_url(page, params)
+            except Exception as e:
+                get_metrics().count("page_errors", cause=type(e).__name__)
+                return None
+
+    async def _check_warm(self, page, params):
+        """Turn warm mode off if a warm run and a full page load of the same matchup disagree."""
+        if self._warm_check_lock is None:
+            self._warm_check_lock = asyncio.Lock()
+        async with self._warm_check_lock:
+            if self.warm_checked:
+                return
+            check = dict(params, sims=WARM_CHECK_SIMS)
+            try:
+                warm = _percent(await self._run_warm(page, check))
+                url = _percent(await self._run_url(page, check))
+            except Exception as e:
+                get_metrics().count("warm_check_errors", cause=type(e).__name__)
+                return  # Try again with the next matchup
+            if warm is None or url is None:
+                return
+            self.warm_checked = True
+            p = (warm + url) / 200
+            tolerance = WARM_CHECK_Z * math.sqrt(2 * max(p * (1 - p), 0.01) / WARM_CHECK_SIMS) * 100
+            if abs(warm - url) > tolerance:
+                get_metrics().count("warm_fallbacks", cause="warm_check_mismatch")
+                self.warm_supported = False
+
+    async def _run_warm(self, page, params):
+        # Titans.html is only loaded the first time a pooled page is used for sims
+        if not page.url.startswith(self.titans_url):
+            if not await load_page_with_retry(page, self.titans_url):
+                return None
+            with get_metrics().span("page_init"):
+                await page.wait_for_load_state("load")
+
+        fields = {**WARM_FIELD_DEFAULTS, **{key: value for key, value in params.items() if key != "bges"}}
+        with get_metrics().span("evaluation"):
+            winrate = await page.evaluate(WARM_SIM_JS, {"query": build_query(params), "fields": fields, "timeout": PAGE_TIMEOUT})
+        if winrate is None:
+            get_metrics().count("warm_fallbacks", cause="page_not_supported")
+            self.warm_supported = False
+        return winrate
+
+    async def _run_url(self, page, params):
+        success = await load_page_with_retry(page, self.simulation_url(params))
+        if not success:
+            return None
+        with get_metrics().span("selector_wait"):
+            if await page.query_selector("#winrate"):
+                winrate = await page.inner_text("#winrate")
+                return winrate.strip()
+        get_metrics().count("page_errors", cause="no_winrate_element")
+        return None
+
+
+class MockBackend:
+    """Synthetic winrates without a browser.
+
+    Every matchup gets a fixed "true" winrate derived from its parameters,
+    and each run returns that plus the noise `sims` fights would have, so
+    the same request always gives the same answer.
+    """
+
+    site_url = REMOTE_SITE_URL
+    has_browser = False
+    cache_id = "mock"  # Never mixed with real results in the cache
+
+    def __init__(self, latency=0.0, concurrency=DEFAULT_POOL_SIZE):
+        self.latency = latency
+        self.concurrency = concurrency
+        self._slots = weakref.WeakKeyDictionary()  # event loop -> Semaphore
+
+    async def run(self, coro):
+        return await coro
+
+    async def simulate(self, params):
+        loop = asyncio.get_running_loop()
+        if loop not in self._slots:
+            self._slots[loop] = asyncio.Semaphore(self.concurrency)
+        async with self._slots[loop]:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return f"{mock_winrate(params):.2f}%"
+
+
+def mock_winrate(params):
+    sims = max(int(params.get("sims", 1)), 1)
+    matchup = json.dumps({key: value for key, value in params.items() if key != "sims"}, sort_keys=True)
+    seed = hashlib.sha1(matchup.encode()).digest()
+    true_winrate = 0.05 + 0.9 * int.from_bytes(seed[:4], "little") / 2**32
+    rng = random.Random(seed + sims.to_bytes(8, "little"))
+    observed = rng.gauss(true_winrate, math.sqrt(true_winrate * (1 - true_winrate) / sims))
+    return min(max(observed, 0.0), 1.0) * 100
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(path):
+    """Serve `path` on a free localhost port from a background thread; returns its base URL."""
+    handler = functools.partial(_QuietHandler, directory=str(path))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, name="simulator-site", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def local_site_url():
+    if os.environ.get("SPELLSTONE_SIMULATOR_URL"):
+        return os.environ["SPELLSTONE_SIMULATOR_URL"]
+    directory = os.environ.get("SPELLSTONE_SIMULATOR_DIR")
+    if not directory:
+        raise ValueError("The local backend needs SPELLSTONE_SIMULATOR_DIR or SPELLSTONE_SIMULATOR_URL")
+    if not (Path(directory) / "Titans.html").is_file():
+        raise ValueError(f"No Titans.html in SPELLSTONE_SIMULATOR_DIR={directory!r}")
+    return serve_directory(directory)
+
+
+def local_cache_id():
+    # A served directory gets a new port every start, so its results are cached under the directory
+    if os.environ.get("SPELLSTONE_SIMULATOR_URL"):
+        return None
+    return "local:" + str(Path(os.environ["SPELLSTONE_SIMULATOR_DIR"]).resolve())
+
+
+def make_backend(name):
+    sim_mode = os.environ.get("SPELLSTONE_SIM_MODE", "warm")
+    if name == "remote":
+        return BrowserBackend(REMOTE_SITE_URL, sim_mode)
+    if name == "local":
+        return BrowserBackend(local_site_url(), sim_mode, local_cache_id())
+    if name == "mock":
+        return MockBackend(float(os.environ.get("SPELLSTONE_MOCK_LATENCY", 0)),
+                           int(os.environ.get("SPELLSTONE_POOL_SIZE", DEFAULT_POOL_SIZE)))
+    raise ValueError(f"Unknown simulator backend {name!r} (expected remote, local or mock)")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The process-wide backend chosen by SPELLSTONE_BACKEND."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = make_backend(os.environ.get("SPELLSTONE_BACKEND", "remote"))
+    return _backend
+
+
+def set_backend(backend):
+    """Use `backend` from now on, e.g. a MockBackend in a benchmark."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
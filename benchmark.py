@@ -0,0 +1,260 @@
+"""Benchmark the simulation pipeline on fixed fixtures.
+
+Examples:
+
+    python benchmark.py
+    python benchmark.py --backend mock --concurrency 2 8 --all-towers
+    python benchmark.py --flows hero cards --sims 1000 --towers 501 "Tree of Life"
+
+Every concurrency level runs in a fresh process with its own browser
+pool of that many pages, one worker process and the result cache
+turned off, so each run simulates everything. Each flow x tower run
+reports pairs/sec, p50/p95 latency per pair (waiting for a free page
+included), the peak memory of the browser processes and where the time
+went (page navigation, page init, JS evaluation, waiting for #winrate, whole
+simulations; see metrics.py), and appends one JSON line to the history file.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from backends import get_backend, set_backend
+from browser_pool import get_pool
+from engine import default_bge, find_replacement, get_card_name_from_hash, load_towers, optimize_deck, optimize_hero
+from metrics import get_metrics
+from standalone import tower_id
+
+
+FIXTURES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_fixtures.json")
+HISTORY_FILE = "benchmark_history.jsonl"
+FLOWS = ["hero", "cards", "replacement"]
+MEMORY_SAMPLE_INTERVAL = 0.2  # seconds
+
+
+class TimedBackend:
+    """Wraps a backend and records how long each simulate() call takes."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.latencies = []
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    async def run(self, coro):
+        return await self.backend.run(coro)
+
+    async def simulate(self, params):
+        start = time.perf_counter()
+        try:
+            return await self.backend.simulate(params)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile, None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def child_rss_mb(root=None):
+    """Resident memory of every process below `root` (the browser), in MB; None without /proc."""
+    root = root or os.getpid()
+    parents, rss_kb = {}, {}
+    try:
+        pids = [entry for entry in os.listdir("/proc") if entry.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("PPid:"):
+                        parents[int(pid)] = int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        rss_kb[int(pid)] = int(line.split()[1])
+        except (OSError, ValueError):
+            continue  # Exited while we were looking
+    children = {}
+    for pid, parent in parents.items():
+        children.setdefault(parent, []).append(pid)
+    total, stack = 0, list(children.get(root, []))
+    while stack:
+        pid = stack.pop()
+        total += rss_kb.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total / 1024
+
+
+class MemorySampler:
+    """Samples child_rss_mb() in the background and keeps the peak."""
+
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="memory-sampler", daemon=True)
+
+    def _sample(self):
+        while True:
+            rss = child_rss_mb()
+            if rss is not None:
+                self.peak_mb = max(self.peak_mb or 0.0, rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def load_fixtures(path=FIXTURES_FILE):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+async def run_flow(flow, fixtures, tower, sims):
+    settings = ("Offence", "Tower Battles", sims, default_bge, tower)
+    if flow == "hero":
+        await optimize_hero(fixtures["deck"], fixtures["opponents"], *settings)
+    elif flow == "cards":
+        await optimize_deck(fixtures["deck"], fixtures["opponents"], *settings)
+    elif flow == "replacement":
+        await find_replacement(fixtures["replacement_deck"], fixtures["cards"], fixtures["opponents"], *settings)
+
+
+async def measure(args):
+    """Runs inside the per-concurrency process; prints one JSON record per flow x tower."""
+    fixtures = load_fixtures(args.fixtures)
+    backend = TimedBackend(get_backend())
+    set_backend(backend)
+    metrics = get_metrics()
+    startup = {}
+
+    if backend.has_browser:
+        start = time.perf_counter()
+        get_pool()
+        startup["browser launch"] = time.perf_counter() - start
+    card_hashes = list(dict.fromkeys(fixtures["cards"]))
+    start = time.perf_counter()
+    for card_hash in card_hashes:
+        await get_card_name_from_hash(card_hash)
+    startup["card name lookup (each)"] = (time.perf_counter() - start) / max(len(card_hashes), 1)
+
+    for tower in args.towers:
+        for flow in args.flows:
+            backend.latencies.clear()
+            metrics.reset()
+            with MemorySampler() as memory:
+                start = time.perf_counter()
+                await run_flow(flow, fixtures, tower, args.sims)
+                seconds = time.perf_counter() - start
+            pairs = len(backend.latencies)
+            record = {
+                "flow": flow,
+                "tower": tower,
+                "pairs": pairs,
+                "seconds": round(seconds, 3),
+                "pairs_per_sec": round(pairs / seconds, 3) if seconds else None,
+                "p50_ms": _ms(percentile(backend.latencies, 0.5)),
+                "p95_ms": _ms(percentile(backend.latencies, 0.95)),
+                "peak_browser_rss_mb": round(memory.peak_mb, 1) if memory.peak_mb is not None else None,
+                "startup": {stage: round(value, 4) for stage, value in startup.items()},
+                "stages": stage_breakdown(metrics),
+                "failures": {name + "".join(f" ({value})" for value in labels.values()): value
+                             for name, labels, value in metrics.counters()},
+            }
+            print(json.dumps(record), flush=True)
+
+
+def stage_breakdown(metrics):
+    """Calls, errors, mean and total time of every span recorded since the last reset."""
+    stages = {}
+    for name, labels, stats in metrics.spans():
+        stage = name + "".join(f" ({value})" for value in labels.values())
+        stages[stage] = {"calls": stats.count, "errors": stats.errors, "mean_ms": _ms(stats.total / stats.count),
+                         "total_s": round(stats.total, 3)}
+    return stages
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_level(args, concurrency):
+    """Run the benchmark at one pool size in a fresh process and return its records."""
+    env = dict(os.environ, SPELLSTONE_POOL_SIZE=str(concurrency), SPELLSTONE_WORKERS="1", SPELLSTONE_CACHE="0",
+               SPELLSTONE_BACKEND=args.backend)
+    command = [sys.executable, os.path.abspath(__file__), "--measure", "--fixtures", args.fixtures, "--sims", str(args.sims),
+               "--flows", *args.flows, "--towers", *args.towers]
+    output = subprocess.run(command, env=env, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(f"Benchmark at concurrency {concurrency} failed:\n{output.stderr}")
+    return [json.loads(line) for line in output.stdout.splitlines() if line.startswith("{")]
+
+
+def main(args):
+    run_info = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "backend": args.backend,
+        "sims": args.sims,
+    }
+    print(f"{'concurrency':>11} {'flow':>12} {'tower':>8} {'pairs':>6} {'pairs/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8}")
+    for concurrency in args.concurrency:
+        for record in run_level(args, concurrency):
+            record = {**run_info, "concurrency": concurrency, **record}
+            with open(args.history, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            print(f"{concurrency:>11} {record['flow']:>12} {record['tower']:>8} {record['pairs']:>6} "
+                  f"{record['pairs_per_sec'] or 0:>8.2f} {record['p50_ms'] or 0:>8.1f} {record['p95_ms'] or 0:>8.1f} "
+                  f"{record['peak_browser_rss_mb'] or 0:>8.1f}")
+            stages = ", ".join(f"{stage} {stats['mean_ms']}ms x{stats['calls']}" for stage, stats in record["stages"].items())
+            print(f"{'':>11} {stages}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hero, card and replacement flows.")
+    parser.add_argument("--backend", choices=["remote", "local", "mock"], default=os.environ.get("SPELLSTONE_BACKEND", "remote"))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="Browser pool sizes to try")
+    parser.add_argument("--flows", nargs="+", choices=FLOWS, default=FLOWS)
+    parser.add_argument("--towers", type=tower_id, nargs="+", default=["501"], help="Tower ids or names from towers.json")
+    parser.add_argument("--all-towers", action="store_true", help="Run every tower in towers.json")
+    parser.add_argument("--sims", type=int, default=1000, help="Sims per matchup")
+    parser.add_argument("--fixtures", default=FIXTURES_FILE)
+    parser.add_argument("--history", default=HISTORY_FILE, help="JSON lines file the results are appended to")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.all_towers:
+        args.towers = [tower["id"] for tower in load_towers()]
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.measure:
+        asyncio.run(measure(args))
+    else:
+        main(args)
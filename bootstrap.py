@@ -0,0 +1,79 @@
+"""One-time setup for the Streamlit app.
+
+Streamlit re-executes app.py on every widget interaction, so anything
+slow here runs once per server process through st.cache_resource and
+is only looked up afterwards.
+"""
+import asyncio
+import glob
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, NamedTuple
+
+import nest_asyncio
+import streamlit as st
+
+from backends import BrowserBackend, get_backend
+from browser_pool import get_pool
+from engine import heroes, load_towers
+
+
+class Startup(NamedTuple):
+    towers: List[dict]
+    heroes: Dict[str, str]
+    timings: Dict[str, float]  # step -> seconds, filled in as steps finish
+
+
+@contextmanager
+def timed(timings, step):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[step] = time.perf_counter() - start
+
+
+def _browsers_path():
+    if os.environ.get("PLAYWRIGHT_BROWSERS_PATH"):
+        return os.environ["PLAYWRIGHT_BROWSERS_PATH"]
+    if sys.platform == "win32":
+        return os.path.join(os.environ.get("LOCALAPPDATA", ""), "ms-playwright")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Caches/ms-playwright")
+    return os.path.expanduser("~/.cache/ms-playwright")
+
+
+def chromium_installed():
+    return bool(glob.glob(os.path.join(_browsers_path(), "chromium*")))
+
+
+def ensure_browsers():
+    """Install Chromium for Playwright, but only when it isn't there yet."""
+    if not chromium_installed():
+        subprocess.check_call([sys.executable, "-m", "playwright", "install", "chromium"])
+
+
+def _warm_up_pool(timings):
+    # Launch the browser while the user is still filling in the form
+    with timed(timings, "browser pool warm-up (background)"):
+        if isinstance(get_backend(), BrowserBackend):
+            get_pool()
+
+
+@st.cache_resource(show_spinner=False)
+def bootstrap():
+    timings = {}
+    with timed(timings, "browser binaries check"):
+        ensure_browsers()
+    with timed(timings, "event loop setup"):
+        if sys.platform == "win32":
+            asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+        nest_asyncio.apply()
+    with timed(timings, "towers.json"):
+        towers = load_towers()
+    threading.Thread(target=_warm_up_pool, args=(timings,), name="pool-warm-up", daemon=True).start()
+    return Startup(towers, heroes, timings)
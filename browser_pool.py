@@ -0,0 +1,190 @@
+import asyncio
+import atexit
+import os
+import threading
+from contextlib import asynccontextmanager
+
+from playwright.async_api import async_playwright
+
+from metrics import get_metrics
+
+
+LAUNCH_ARGS = ["--disable-gpu", "--no-sandbox"]
+DEFAULT_POOL_SIZE = 8
+HEALTH_CHECK_TIMEOUT = 5  # seconds
+
+
+class BrowserPool:
+    """One Chromium process with a fixed number of warm pages.
+
+    The pool lives on its own event loop in a background thread, so it
+    survives Streamlit reruns (which start a fresh loop every time).
+    Coroutines that use the pool are handed over with `run()`.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, headless=True):
+        self.size = size
+        self.headless = headless
+        self.loop = None
+        self.recycled_pages = 0
+        self.browser_launches = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._pages = None  # asyncio.Queue of idle pages (None = needs a new page)
+        self._relaunch_lock = None  # asyncio.Lock on the pool's loop
+        self._dedicated = {}  # name -> (asyncio.Lock, page) kept out of the simulation pages
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self.loop.run_forever, name="browser-pool", daemon=True)
+            self._thread.start()
+            try:
+                asyncio.run_coroutine_threadsafe(self._launch(), self.loop).result()
+            except BaseException:
+                # Chromium missing, launch timed out, ...: leave the pool unstarted so the next borrower retries
+                self._stop()
+                raise
+
+    async def run(self, coro):
+        """Await `coro` on the pool's event loop, from whatever loop we are on."""
+        self.start()
+        try:
+            if asyncio.get_running_loop() is self.loop:
+                return await coro
+        except RuntimeError:
+            pass
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    async def _launch(self):
+        self._relaunch_lock = asyncio.Lock()
+        self._playwright = await async_playwright().start()
+        await self._launch_browser()
+        self._pages = asyncio.Queue()
+        for _ in range(self.size):
+            self._pages.put_nowait(await self._context.new_page())
+
+    async def _launch_browser(self):
+        with get_metrics().span("launch"):
+            self._browser = await self._playwright.chromium.launch(headless=self.headless, args=LAUNCH_ARGS)
+            self._context = await self._browser.new_context()
+        self.browser_launches += 1
+
+    async def _new_page(self):
+        # A crashed renderer can take the whole browser down with it. Only one
+        # borrower relaunches it; the others wait and use the new browser
+        async with self._relaunch_lock:
+            if not self._browser.is_connected():
+                await self._launch_browser()
+        return await self._context.new_page()
+
+    async def _is_healthy(self, page):
+        if page is None or page.is_closed():
+            return False
+        try:
+            await asyncio.wait_for(page.evaluate("1"), HEALTH_CHECK_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    async def _recycle(self, page, reason):
+        self.recycled_pages += 1
+        get_metrics().count("page_recycles", reason=reason)
+        if page is not None and not page.is_closed():
+            try:
+                await page.close()
+            except Exception:
+                pass
+        try:
+            return await self._new_page()
+        except Exception:
+            # Leave an empty slot, the next borrower will try again
+            return None
+
+    @asynccontextmanager
+    async def page(self):
+        """Borrow a healthy page; it goes back to the pool afterwards."""
+        page = await self._pages.get()
+        try:
+            if not await self._is_healthy(page):
+                page = await self._recycle(page, "unhealthy")
+                if page is None:
+                    page = await self._new_page()
+            yield page
+        except BaseException:
+            # We don't know what state the page was left in
+            page = await self._recycle(page, "error")
+            raise
+        finally:
+            self._pages.put_nowait(page)
+
+    @asynccontextmanager
+    async def dedicated_page(self, name):
+        """Borrow the page kept for `name` (e.g. card lookups) outside the simulation pages.
+
+        One borrower at a time; the page is created on first use and replaced when unhealthy.
+        """
+        if name not in self._dedicated:
+            self._dedicated[name] = (asyncio.Lock(), None)
+        lock, page = self._dedicated[name]
+        async with lock:
+            page = self._dedicated[name][1]
+            if page is None:
+                page = await self._new_page()
+            elif not await self._is_healthy(page):
+                page = await self._recycle(page, "unhealthy") or await self._new_page()
+            try:
+                yield page
+            except BaseException:
+                page = await self._recycle(page, "error")
+                raise
+            finally:
+                self._dedicated[name] = (lock, page)
+
+    async def _shutdown(self):
+        try:
+            if self._browser is not None:
+                await self._browser.close()
+        finally:
+            if self._playwright is not None:
+                await self._playwright.stop()
+
+    def _stop(self):
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(timeout=30)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        self._thread = None
+        self.loop = None
+        self._playwright = self._browser = self._context = self._pages = None
+        self._dedicated = {}
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use.
+
+    The number of warm pages comes from SPELLSTONE_POOL_SIZE (default 8).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(size=int(os.environ.get("SPELLSTONE_POOL_SIZE", DEFAULT_POOL_SIZE)))
+            atexit.register(_pool.close)
+    _pool.start()
+    return _pool
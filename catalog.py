@@ -0,0 +1,52 @@
+import json
+import os
+
+from deck_hash import decode_unit, split_units
+
+
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cards.json")
+CATALOG_VERSION = 1
+
+
+class Catalog:
+    """Card and rune names extracted from SIMSpellstone (see extract_names.py)."""
+
+    def __init__(self, cards, runes, extracted_at=None):
+        self.cards = cards  # card id -> name
+        self.runes = runes  # rune id -> name
+        self.extracted_at = extracted_at
+
+    @classmethod
+    def load(cls, path=CATALOG_FILE):
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != CATALOG_VERSION:
+            raise ValueError(f"{path} has catalog version {data.get('version')}, expected {CATALOG_VERSION}")
+        cards = {int(card_id): name for card_id, name in data["cards"].items()}
+        runes = {int(rune_id): name for rune_id, name in data["runes"].items()}
+        return cls(cards, runes, data.get("extracted_at"))
+
+    def card_name(self, unit_hash):
+        """Return [card_name, rune_name] for a 5-char hash, or None if the card is unknown."""
+        try:
+            unit = decode_unit(unit_hash)
+        except ValueError:
+            return None
+        if unit.id not in self.cards:
+            return None
+        return [self.cards[unit.id], self.runes.get(unit.rune_id, "")]
+
+    def deck_names(self, deck_hash):
+        """Names for every 5-char unit in a deck hash, hero first."""
+        return [self.card_name(unit_hash) for unit_hash in split_units(deck_hash)]
+
+
+_catalog = None
+
+
+def get_catalog():
+    """The local catalog, loaded once per process. None if cards.json hasn't been extracted yet."""
+    global _catalog
+    if _catalog is None and os.path.exists(CATALOG_FILE):
+        _catalog = Catalog.load()
+    return _catalog
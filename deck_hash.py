@@ -0,0 +1,137 @@
+"""Encode and decode SIMSpellstone deck hashes.
+
+A deck hash is a run of 5-char units: the hero first, then one unit per card.
+Each unit packs the card id, fusion, level and rune into a little-endian
+base64 number (see SIMSpellstone's unitInfo_to_base64).
+"""
+from collections import Counter
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+
+# SIMSpellstone's hash alphabet (base64 with "!" and "~" instead of "+" and "/")
+BASE64_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789!~"
+BASE64_VALUES = {char: value for value, char in enumerate(BASE64_CHARS)}
+UNIT_HASH_LENGTH = 5
+RUNE_ID_OFFSET = 5000  # Rune ids are all in the range 5001 - 5500
+
+
+class Unit(NamedTuple):
+    id: int
+    level: int
+    rune_id: Optional[int] = None
+
+
+class Deck(NamedTuple):
+    hero: Unit
+    cards: Tuple[Unit, ...]
+
+
+def split_units(deck_hash):
+    """Split a hash into its 5-char units, raising ValueError on a malformed hash."""
+    if len(deck_hash) % UNIT_HASH_LENGTH:
+        raise ValueError(f"Deck hash length {len(deck_hash)} is not a multiple of {UNIT_HASH_LENGTH}: {deck_hash!r}")
+    return tuple(deck_hash[i:i + UNIT_HASH_LENGTH] for i in range(0, len(deck_hash), UNIT_HASH_LENGTH))
+
+
+@lru_cache(maxsize=None)
+def decode_unit(unit_hash):
+    """Decode one 5-char unit hash into a Unit."""
+    if len(unit_hash) != UNIT_HASH_LENGTH:
+        raise ValueError(f"Unit hash must be {UNIT_HASH_LENGTH} chars: {unit_hash!r}")
+    dec = 0
+    for char in reversed(unit_hash):
+        try:
+            dec = dec * 64 + BASE64_VALUES[char]
+        except KeyError:
+            raise ValueError(f"Invalid character {char!r} in unit hash {unit_hash!r}") from None
+    rune = dec % 1000
+    dec //= 1000
+    level = dec % 7
+    dec //= 7
+    fusion = dec % 3
+    card_id = dec // 3 + fusion * 10000
+    return Unit(card_id, level + 1, rune + RUNE_ID_OFFSET if rune else None)
+
+
+@lru_cache(maxsize=None)
+def encode_unit(unit):
+    """Encode a Unit back into its 5-char hash."""
+    fusion, base_id = divmod(unit.id, 10000)
+    rune = unit.rune_id - RUNE_ID_OFFSET if unit.rune_id else 0
+    dec = ((base_id * 3 + fusion) * 7 + unit.level - 1) * 1000 + rune
+    chars = []
+    for _ in range(UNIT_HASH_LENGTH):
+        dec, value = divmod(dec, 64)
+        chars.append(BASE64_CHARS[value])
+    return "".join(chars)
+
+
+def decode(deck_hash):
+    units = split_units(deck_hash)
+    if not units:
+        raise ValueError("Empty deck hash")
+    return Deck(decode_unit(units[0]), tuple(decode_unit(unit) for unit in units[1:]))
+
+
+def encode(deck):
+    return encode_unit(deck.hero) + "".join(encode_unit(card) for card in deck.cards)
+
+
+# Variant generators. These work on the unit strings directly, so a card
+# is always removed or swapped by position and never by substring match.
+
+def hero_variants(deck_hash, hero_hashes):
+    """One deck per hero, keeping the cards."""
+    cards = "".join(split_units(deck_hash)[1:])
+    return [hero_hash + cards for hero_hash in hero_hashes]
+
+
+def removal_variants(deck_hash):
+    """(card_hash, deck without that card) for each distinct card.
+
+    Duplicate cards are only removed once, from their first position.
+    """
+    units = split_units(deck_hash)
+    variants = []
+    seen = set()
+    for position in range(1, len(units)):
+        card_hash = units[position]
+        if card_hash in seen:
+            continue
+        seen.add(card_hash)
+        variants.append((card_hash, "".join(units[:position] + units[position + 1:])))
+    return variants
+
+
+def addition_variants(deck_hash, card_hashes):
+    """(card_hash, deck with that card appended) for each candidate card."""
+    split_units(deck_hash + "".join(card_hashes))  # Raises on malformed input
+    return [(card_hash, deck_hash + card_hash) for card_hash in card_hashes]
+
+
+def swap_variants(deck_hash, swaps):
+    """(swap, deck) for each (removed card hashes, added card hashes) swap.
+
+    Each removed card is taken out at its first remaining position and
+    the added cards are appended, so a one-card swap that removes the same
+    card as a removal variant gives the same hash as adding to that variant.
+    """
+    units = split_units(deck_hash)
+    variants = []
+    for removed, added in swaps:
+        cards = list(units[1:])
+        for card_hash in removed:
+            if card_hash not in cards:
+                raise ValueError(f"Card {card_hash!r} is not in deck {deck_hash!r}")
+            cards.remove(card_hash)
+        split_units("".join(added))
+        variants.append(((tuple(removed), tuple(added)), units[0] + "".join(cards) + "".join(added)))
+    return variants
+
+
+def deck_diff(deck_hash, other_hash):
+    """(cards only in deck_hash, cards only in other_hash), counting duplicates; heroes are ignored."""
+    cards = Counter(split_units(deck_hash)[1:])
+    other_cards = Counter(split_units(other_hash)[1:])
+    return tuple((cards - other_cards).elements()), tuple((other_cards - cards).elements())
@@ -0,0 +1,338 @@
+"""The optimizations behind the app's three buttons, usable without Streamlit.
+
+app.py renders these in the browser and standalone.py runs them from the
+command line; neither adds any simulation logic of its own.
+"""
+import asyncio
+import json
+import os
+from collections import Counter
+from itertools import combinations_with_replacement
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from backends import get_backend
+from browser_pool import get_pool
+from catalog import get_catalog
+from deck_hash import addition_variants, hero_variants, removal_variants, split_units, swap_variants
+from matchups import MatchupPlanner, combined_means
+from racing import RaceResult, race
+
+
+TOWERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "towers.json")
+
+# Define constants
+default_bge = "BDCD"
+
+# Swap search: how many swap decks get simulated at most, and how far (in
+# winrate %) below the k-th best estimate a swap may be and still be tried
+MAX_SWAP_DECKS = 40
+SWAP_SLACK = 2.0
+
+heroes = {
+    "Samael": "gmQAA",
+    "Tarian the Lich Lord": "4!fAA",
+    "Groc the Hammer": "QXvAA",
+    "Rayne the Wavecrasher": "Yf0AA",
+    "Orgoth the Hex Fist": "gn5AA",
+    "Ol' Cedric": "ov!AA",
+    "Oda the Aegis": "w3DBA",
+    "Yuriel the Manashifter": "4~IBA",
+    "Aria the Nightwielder": "AIOBA",
+    "Decim the Pyrokinetic": "IQTBA",
+    "Elyse the Truestriker": "QYYBA",
+    "General Ursurio": "YgdBA",
+    "Scyer the Fury Mecha": "goiBA"
+}
+
+
+def load_towers(path=TOWERS_FILE):
+    with open(path, "r") as f:
+        return json.load(f)  # Expects a list of {"name": ..., "id": ...}
+
+
+class SweepResult(NamedTuple):
+    winrates: Dict[str, Optional[float]]  # candidate deck -> average winrate (None if every sim failed)
+    race: Optional[RaceResult] = None
+    baseline: Optional[float] = None  # the baseline deck's winrate, when sweep() got one
+    deltas: Optional[Dict[str, Optional[float]]] = None  # candidate deck -> winrate minus the baseline's
+
+
+async def get_card_name_from_hash(card_hash):
+    # Look the card up in the local catalog first (see extract_names.py)
+    catalog = get_catalog()
+    if catalog is not None:
+        names = catalog.card_name(card_hash)
+        if names is not None:
+            return names
+
+    # Without a browser (mock backend) the hash has to do as the name
+    if not get_backend().has_browser:
+        return [card_hash, ""]
+
+    # Cards newer than the catalog are fetched using the hash on the website
+    pool = get_pool()
+    try:
+        return await pool.run(_get_card_name_page(pool, card_hash))
+    except Exception:
+        return [card_hash, ""]  # Unknown card or a page error; a hash beats a crashed optimization
+
+
+async def get_card_names(card_hashes, known=None):
+    """card hash -> (name, rune) for every distinct hash; hashes already in `known` aren't looked up again."""
+    names = dict(known or {})
+    for card_hash in dict.fromkeys(card_hashes):
+        if card_hash not in names:
+            names[card_hash] = tuple(await get_card_name_from_hash(card_hash))
+    return names
+
+
+async def _get_card_name_page(pool, card_hash):
+    deckbuilder_url = get_backend().site_url + "DeckBuilder.html"
+    # A page of its own, so the simulation pages keep Titans.html loaded
+    async with pool.dedicated_page("deckbuilder") as page:
+        # Open the DeckBuilder website, unless this page already has it loaded
+        if not page.url.startswith(deckbuilder_url):
+            await page.goto(deckbuilder_url)
+            await page.wait_for_load_state("domcontentloaded")
+
+        js_script = f"""
+        (() => {{
+            // Decode the hash to get deck info
+            var d = hash_decode("{card_hash}");
+
+            // Extract the ID from the first card in the deck
+            var card_id = d.deck[0].id;
+            var rune_id = d.deck[0].runes[0].id;  // FIXED: use 'd' instead of 'c'
+
+            var cardName = "";
+            var cardRune = "";
+
+            // Check if CARDS is available and search for the card name
+            Object.values(CARDS).forEach(c => {{
+                if (c.id == card_id) {{
+                    cardName = c.name;
+                }}
+            }});
+
+            // Check if RUNES is available and search for the rune name
+            
+            Object.values(RUNES).forEach(c => {{
+                if (c.id == rune_id) {{
+                    cardRune = c.name;
+                }}
+            }});
+
+            return [cardName, cardRune];  // FIXED: Return an array instead of tuple
+        }})()
+        """
+
+        # Get the card name by executing the JavaScript code
+        card_name, card_rune = await page.evaluate(js_script)
+        return [card_name, card_rune]
+
+
+async def sweep(candidate_decks, opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision=None, racing=False,
+                on_update=None, baseline=None, weights=None):
+    """Average winrate of each candidate deck over all opponents, weighted by `weights` if given.
+
+    For Offence the candidates attack the opponents, for Defence the opponents
+    attack the candidates; the winrate is always the attacker's.
+    `on_update(winrates, done, total)` gets the running averages as results come in.
+    With a `baseline` deck, its winrate and each candidate's difference to it are included.
+    """
+    planner = MatchupPlanner(opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision, weights)
+    if baseline is not None:
+        planner.request([baseline])
+
+    if racing:
+        race_result = await race(candidate_decks, opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type,
+                                 on_update=on_update, weights=weights)
+        matrix = await planner.run()
+        winrates = race_result.winrates
+    else:
+        # Baseline and candidates go out as one batch; a candidate equal to the baseline is simulated once
+        planner.request(candidate_decks)
+        matrix = await planner.run(on_update, watch=candidate_decks)
+        winrates = matrix.means(candidate_decks)
+        race_result = None
+
+    if baseline is None:
+        return SweepResult(winrates, race_result)
+    baseline_winrate = matrix.means([baseline])[baseline]
+    if racing:
+        deltas = {deck: winrate - baseline_winrate if None not in (winrate, baseline_winrate) else None
+                  for deck, winrate in winrates.items()}
+    else:
+        deltas = matrix.deltas(baseline, candidate_decks)
+    return SweepResult(winrates, race_result, baseline_winrate, deltas)
+
+
+async def optimize_deck(your_deck, opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision=None, racing=False,
+                        on_update=None, weights=None, card_names=None):
+    """Winrate of the deck, and of the deck with each of its cards removed.
+
+    The removal winrates are keyed by the variant deck: two copies of a card
+    with different runes or levels share a name but are separate removals.
+    `on_update` follows the removal variants; see sweep(). `card_names`
+    (card hash -> (name, rune)) saves looking up names the caller already has.
+    """
+    modified_decks = []
+    removed_names = []
+    removed_runes = []
+
+    # One variant per distinct card, each with that card removed by position
+    variants = removal_variants(your_deck)
+    card_names = await get_card_names([card_hash for card_hash, _ in variants], card_names)
+    for card_hash, modified_deck in variants:
+        card_name, card_rune = card_names[card_hash]
+        modified_decks.append(modified_deck)
+        removed_names.append(card_name)  # Store card names
+        removed_runes.append(card_rune)
+
+    # Only the most promising removals get the full sim count when racing
+    removals = await sweep(modified_decks, opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision, racing,
+                           on_update, baseline=your_deck, weights=weights)
+    avg_winrate = removals.baseline  # None if every sim of the deck failed
+    avg_winrates = {modified_deck: removals.winrates[modified_deck] for modified_deck in modified_decks}
+
+    return avg_winrate, avg_winrates, removed_names, removed_runes, removals.race
+
+
+async def optimize_hero(your_deck, opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision=None, racing=False,
+                        on_update=None, weights=None):
+    """Try every hero in `heroes` with the deck's cards. Returns (hero name -> deck, SweepResult)."""
+    hero_decks = dict(zip(heroes.keys(), hero_variants(your_deck, heroes.values())))
+    result = await sweep(list(hero_decks.values()), opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision, racing,
+                         on_update, weights=weights)
+    return hero_decks, result
+
+
+async def find_replacement(your_deck, card_hashes, opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision=None, racing=False,
+                           on_update=None, weights=None, card_names=None):
+    """Try each candidate card in a deck that has a free slot.
+
+    Returns (card hash -> (name, rune), card hash -> deck, SweepResult).
+    Names already in `card_names` aren't looked up again.
+    """
+    card_info = await get_card_names(card_hashes, card_names)
+    card_decks = dict(addition_variants(your_deck, card_hashes))
+    result = await sweep(list(card_decks.values()), opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision, racing,
+                         on_update, weights=weights)
+    return card_info, card_decks, result
+
+
+class Swap(NamedTuple):
+    removed: Tuple[str, ...]  # card hashes taken out of the deck
+    added: Tuple[str, ...]  # card hashes put in
+    deck: str
+    estimate: float  # predicted from the single-card scores
+    winrate: Optional[float]  # simulated
+
+
+class SwapResult(NamedTuple):
+    baseline: Optional[float]  # winrate of the deck as it is
+    swaps: List[Swap]  # the best swaps, best first
+    considered: int  # swaps the single-card scores were estimated for
+    simulated: int  # swaps that survived pruning and were simulated in full
+
+
+async def find_swaps(your_deck, card_hashes, opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision=None, racing=False,
+                     on_update=None, swap_size=1, top_k=5, max_decks=MAX_SWAP_DECKS, slack=SWAP_SLACK, weights=None):
+    """Best ways to swap `swap_size` cards of a full deck for cards from `card_hashes`.
+
+    Simulating every swap is quadratic in sims, so this first scores each
+    card on its own: every removal (as in optimize_deck) and every
+    candidate card in the slot freed by the least useful card (as in
+    find_replacement). Adding those effects up predicts every swap; only
+    the swaps predicted to come close to the top `top_k` are simulated.
+    `on_update` follows the simulated swap decks; see sweep().
+    """
+    sign = 1 if deck_type == "Offence" else -1
+    planner = MatchupPlanner(opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision, weights)
+
+    # Single-card removals, together with the deck itself
+    removal_decks = dict(removal_variants(your_deck))
+    planner.request([your_deck, *removal_decks.values()])
+    matrix = await planner.run()
+    baseline = matrix.means([your_deck])[your_deck]
+    removal_winrates = matrix.means(list(removal_decks.values()))
+    removals = {card_hash: removal_winrates[deck] for card_hash, deck in removal_decks.items()
+                if removal_winrates[deck] is not None}
+    if baseline is None or not removals:
+        return SwapResult(baseline, [], 0, 0)
+
+    # Single-card additions, in the slot of the card the deck misses least
+    weakest = max(removals, key=lambda card_hash: sign * removals[card_hash])
+    addition_decks = dict(addition_variants(removal_decks[weakest], card_hashes))
+    planner.request(addition_decks.values())
+    matrix = await planner.run()
+    addition_winrates = matrix.means(list(addition_decks.values()))
+    gains = {card_hash: addition_winrates[deck] - removals[weakest] for card_hash, deck in addition_decks.items()
+             if addition_winrates[deck] is not None}
+
+    # Predict every swap and keep the ones that could make the top k
+    card_counts = Counter(split_units(your_deck)[1:])
+    estimates = []
+    for removed in combinations_with_replacement(removals, swap_size):
+        if any(removed.count(card_hash) > card_counts[card_hash] for card_hash in removed):
+            continue
+        for added in combinations_with_replacement(gains, swap_size):
+            if set(removed) & set(added):
+                continue  # Putting a card back is a smaller swap
+            estimate = (baseline + sum(removals[card_hash] - baseline for card_hash in removed)
+                        + sum(gains[card_hash] for card_hash in added))
+            estimates.append(((removed, added), estimate))
+    if not estimates:
+        return SwapResult(baseline, [], 0, 0)
+    estimates.sort(key=lambda item: sign * item[1], reverse=True)
+    cutoff = sign * estimates[min(top_k, len(estimates)) - 1][1] - slack
+    kept = dict(item for item in estimates[:max_decks] if sign * item[1] >= cutoff)
+
+    swap_decks = dict(swap_variants(your_deck, kept))
+    if racing:
+        winrates = (await race(list(swap_decks.values()), opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type,
+                               on_update=on_update, weights=weights)).winrates
+    else:
+        planner.request(swap_decks.values())
+        matrix = await planner.run(on_update, watch=list(swap_decks.values()))
+        winrates = matrix.means(list(swap_decks.values()))
+
+    swaps = [Swap(removed, added, deck, kept[removed, added], winrates[deck]) for (removed, added), deck in swap_decks.items()]
+    swaps.sort(key=lambda swap: sign * swap.winrate if swap.winrate is not None else float("-inf"), reverse=True)
+    return SwapResult(baseline, swaps[:top_k], len(estimates), len(swap_decks))
+
+
+class ConfigSweepResult(NamedTuple):
+    configs: List[Tuple[str, str]]  # (tower_type, BGE)
+    winrates: List[Dict[str, Optional[float]]]  # per config: candidate deck -> average winrate
+    overall: Dict[str, Optional[float]]  # candidate deck -> weighted average over the configs
+
+
+async def sweep_configs(candidate_decks, opponents_decks, deck_type, battle_type, numb_sims, configs, precision=None,
+                        on_update=None, weights=None, config_weights=None):
+    """Like sweep(), for several (tower_type, BGE) configs in one batch.
+
+    Every config's matchups go to the shared pool together, so the pages
+    stay busy from the first config to the last. The overall winrate
+    averages the configs, weighted by `config_weights` if given.
+    `on_update(overall winrates, done, total)` covers all configs.
+    """
+    candidate_decks = list(dict.fromkeys(candidate_decks))
+    planners = []
+    for tower_type, BGE in configs:
+        planner = MatchupPlanner(opponents_decks, deck_type, battle_type, numb_sims, BGE, tower_type, precision, weights)
+        planner.request(candidate_decks)
+        planners.append(planner)
+    progress = [(0, len(planner.matrix.missing(candidate_decks))) for planner in planners]
+
+    def reporter(i):
+        def on_config_update(winrates, done, total):
+            progress[i] = (done, total)
+            overall = combined_means([planner.matrix for planner in planners], candidate_decks, config_weights)
+            on_update(overall, sum(done for done, _ in progress), sum(total for _, total in progress))
+        return on_config_update if on_update is not None else None
+
+    await asyncio.gather(*(planner.run(reporter(i), watch=candidate_decks) for i, planner in enumerate(planners)))
+    matrices = [planner.matrix for planner in planners]
+    return ConfigSweepResult([tuple(config) for config in configs], [matrix.means(candidate_decks) for matrix in matrices],
+                             combined_means(matrices, candidate_decks, config_weights))
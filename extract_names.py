@@ -0,0 +1,53 @@
+"""Extract the CARDS and RUNES tables from SIMSpellstone into cards.json.
+
+Run this once (and again whenever new cards are released):
+
+    python extract_names.py
+
+The app then resolves card names from the local file without a browser.
+"""
+import asyncio
+import json
+from datetime import datetime, timezone
+
+from playwright.async_api import async_playwright
+
+from backends import get_backend
+from catalog import CATALOG_FILE, CATALOG_VERSION
+
+EXTRACT_JS = """
+(() => {
+    var cards = {};
+    Object.values(CARDS).forEach(c => { cards[c.id] = c.name; });
+    var runes = {};
+    Object.values(RUNES).forEach(r => { runes[r.id] = r.name; });
+    return {cards: cards, runes: runes};
+})()
+"""
+
+
+async def extract(path=CATALOG_FILE):
+    # SPELLSTONE_BACKEND=local reads the tables from a local copy of the site
+    deckbuilder_url = get_backend().site_url + "DeckBuilder.html"
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=["--disable-gpu", "--no-sandbox"])
+        page = await browser.new_page()
+        await page.goto(deckbuilder_url, timeout=100000)
+        await page.wait_for_load_state("load")
+        tables = await page.evaluate(EXTRACT_JS)
+        await browser.close()
+
+    catalog = {
+        "version": CATALOG_VERSION,
+        "extracted_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "source": deckbuilder_url,
+        "cards": tables["cards"],
+        "runes": tables["runes"],
+    }
+    with open(path, "w") as f:
+        json.dump(catalog, f, indent=1, sort_keys=True)
+    print(f"Wrote {len(tables['cards'])} cards and {len(tables['runes'])} runes to {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(extract())
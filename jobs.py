@@ -0,0 +1,248 @@
+"""Background jobs for the optimizations, shared by every Streamlit session.
+
+A job runs on the manager's own event loop thread, so it survives
+Streamlit reruns and page reloads. Script runs only submit jobs and read
+their progress by ID. Submitting a job identical to one that is already
+queued or running returns that job instead of starting a second one.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from deck_hash import addition_variants, deck_diff, hero_variants, removal_variants, split_units
+from engine import find_replacement, find_swaps, get_card_names, heroes, optimize_deck, optimize_hero, sweep_configs
+
+
+DEFAULT_MAX_RUNNING = 2
+JOB_TTL = 24 * 3600  # seconds a finished job stays available
+MAX_FINISHED_JOBS = 200
+WATCHER_TTL = 30  # seconds a session counts as watching a job after it last polled it
+
+
+class Job:
+    def __init__(self, job_id, kind, params):
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.status = "queued"  # queued, running, done, failed or cancelled
+        self.labels: Dict[str, str] = {}  # candidate deck -> display name
+        self.winrates: Dict[str, Optional[float]] = {}  # running averages while the job runs
+        self.done = 0
+        self.total = 0
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.watchers: Dict[str, float] = {}  # session -> when it last looked at the job
+        self._task = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def update(self, winrates, done, total):
+        # Passed to the engine as on_update
+        self.winrates = winrates
+        self.done = done
+        self.total = total
+
+
+def job_id_for(kind, params):
+    """Same optimization, same ID: that's what lets users share a run."""
+    payload = json.dumps({"kind": kind, "params": params}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:12]
+
+
+def _card_labels(pairs, names):
+    return {deck: f"{names[card_hash][0]} ({names[card_hash][1]})" for card_hash, deck in pairs}
+
+
+def _settings(params):
+    return (params["deck_type"], params["battle_type"], params["numb_sims"], params["BGE"], params["tower_type"],
+            params["precision"], params["racing"])
+
+
+async def _run_cards(job):
+    p = job.params
+    variants = removal_variants(p["deck"])
+    # Looked up once, for the labels and the engine
+    names = await get_card_names(card_hash for card_hash, _ in variants)
+    job.labels = _card_labels(variants, names)
+    return await optimize_deck(p["deck"], p["opponents"], *_settings(p), on_update=job.update, weights=p.get("weights"),
+                               card_names=names)
+
+
+async def _run_hero(job):
+    p = job.params
+    job.labels = dict(zip(hero_variants(p["deck"], heroes.values()), heroes))
+    return await optimize_hero(p["deck"], p["opponents"], *_settings(p), on_update=job.update, weights=p.get("weights"))
+
+
+async def _run_replacement(job):
+    p = job.params
+    names = await get_card_names(p["cards"])
+    job.labels = _card_labels(addition_variants(p["deck"], p["cards"]), names)
+    return await find_replacement(p["deck"], p["cards"], p["opponents"], *_settings(p), on_update=job.update,
+                                  weights=p.get("weights"), card_names=names)
+
+
+async def _run_swap(job):
+    p = job.params
+    card_names = await get_card_names(split_units(p["deck"])[1:] + tuple(p["cards"]))
+    names = {card_hash: f"{card_name} ({card_rune})" for card_hash, (card_name, card_rune) in card_names.items()}
+
+    def on_update(winrates, done, total):
+        # The swap decks are only known once the single-card scores are in
+        for deck in winrates:
+            if deck not in job.labels:
+                removed, added = deck_diff(p["deck"], deck)
+                job.labels[deck] = swap_label(removed, added, names)
+        job.update(winrates, done, total)
+
+    return await find_swaps(p["deck"], p["cards"], p["opponents"], *_settings(p), on_update=on_update,
+                            swap_size=p["swap_size"], top_k=p["top_k"], weights=p.get("weights"))
+
+
+async def _run_configs(job):
+    # One of the other flows' candidates, swept over several (tower, BGE) configs
+    p = job.params
+    if p["flow"] == "cards":
+        variants = removal_variants(p["deck"])
+        names = await get_card_names(card_hash for card_hash, _ in variants)
+        job.labels = {p["deck"]: "(current deck)", **_card_labels(variants, names)}
+    elif p["flow"] == "hero":
+        job.labels = dict(zip(hero_variants(p["deck"], heroes.values()), heroes))
+    else:
+        job.labels = _card_labels(addition_variants(p["deck"], p["cards"]), await get_card_names(p["cards"]))
+    configs = [tuple(config) for config in p["configs"]]
+    return await sweep_configs(list(job.labels), p["opponents"], p["deck_type"], p["battle_type"], p["numb_sims"], configs,
+                               p["precision"], on_update=job.update, weights=p.get("weights"),
+                               config_weights=p.get("config_weights"))
+
+
+def swap_label(removed, added, names):
+    removed_names = " + ".join(names.get(card_hash, card_hash) for card_hash in removed)
+    added_names = " + ".join(names.get(card_hash, card_hash) for card_hash in added)
+    return f"{removed_names} → {added_names}"
+
+
+RUNNERS = {"cards": _run_cards, "hero": _run_hero, "replacement": _run_replacement, "swap": _run_swap,
+           "configs": _run_configs}
+
+
+class JobManager:
+    """Runs at most `max_running` jobs at a time; the rest wait in order."""
+
+    def __init__(self, max_running=DEFAULT_MAX_RUNNING):
+        self.max_running = max_running
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._slots = None
+        threading.Thread(target=self._loop.run_forever, name="jobs", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._make_slots(), self._loop).result()
+
+    async def _make_slots(self):
+        self._slots = asyncio.Semaphore(self.max_running)
+
+    def submit(self, kind, params, watcher=None):
+        """Queue a job (or join the identical one still queued or running) and return its ID."""
+        job_id = job_id_for(kind, params)
+        with self._lock:
+            self._forget_old_jobs()
+            job = self._jobs.get(job_id)
+            # Finished jobs are re-run; the result cache makes that cheap
+            if job is None or not job.active:
+                job = Job(job_id, kind, params)
+                self._jobs[job_id] = job
+                self._loop.call_soon_threadsafe(self._start, job)
+            if watcher is not None:
+                job.watchers[watcher] = time.time()
+        return job_id
+
+    def watch(self, job_id, watcher):
+        """Note that `watcher` is looking at the job; call on every poll to stay a watcher."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.active:
+                job.watchers[watcher] = time.time()
+
+    def get(self, job_id) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_position(self, job):
+        with self._lock:
+            waiting = sorted((j for j in self._jobs.values() if j.status == "queued"), key=lambda j: j.created)
+        return waiting.index(job) + 1 if job in waiting else 0
+
+    def cancel(self, job_id, watcher=None):
+        """Stop watching a job; it is only cancelled once nobody else is watching it.
+
+        Sessions that haven't polled the job for WATCHER_TTL seconds (closed
+        tabs, ended sessions) don't count.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.active:
+                return
+            job.watchers.pop(watcher, None)
+            cutoff = time.time() - WATCHER_TTL
+            job.watchers = {other: seen for other, seen in job.watchers.items() if seen > cutoff}
+            if job.watchers:
+                return
+        self._loop.call_soon_threadsafe(self._cancel, job)
+
+    def _start(self, job):
+        job._task = self._loop.create_task(self._run(job))
+        job._task.add_done_callback(lambda task: self._cancelled_before_start(job))
+
+    @staticmethod
+    def _cancelled_before_start(job):
+        # A task cancelled before its first step never runs _run's body
+        if job.active:
+            job.finished = time.time()
+            job.status = "cancelled"
+
+    def _cancel(self, job):
+        if job._task is not None:
+            job._task.cancel()
+
+    async def _run(self, job):
+        try:
+            async with self._slots:
+                job.status = "running"
+                job.result = await RUNNERS[job.kind](job)
+            status = "done"
+        except asyncio.CancelledError:
+            status = "cancelled"
+        except Exception as e:
+            status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        # Finished jobs are sorted by `finished`, so set it before the job stops counting as active
+        job.finished = time.time()
+        job.status = status
+
+    def _forget_old_jobs(self):
+        finished = sorted((job for job in self._jobs.values() if not job.active), key=lambda job: job.finished)
+        cutoff = time.time() - JOB_TTL
+        for i, job in enumerate(finished):
+            if job.finished < cutoff or len(finished) - i > MAX_FINISHED_JOBS:
+                del self._jobs[job.id]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """The process-wide job manager. SPELLSTONE_MAX_JOBS sets how many jobs run at once."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(int(os.environ.get("SPELLSTONE_MAX_JOBS", DEFAULT_MAX_RUNNING)))
+    return _manager
@@ -0,0 +1,148 @@
+"""Winrates of deck variants against opponents, kept as one dense matrix.
+
+Rows are candidate decks, columns are opponents. A planner gathers every
+row the optimizations ask for, drops duplicates and simulates only the
+cells that aren't filled yet, so a deck that shows up in several
+requests (the current deck as a baseline, the current hero among the
+hero variants, ...) is simulated once per opponent.
+"""
+from typing import Dict, Optional
+
+import numpy as np
+
+from simulator import stream_pairs
+
+
+class MatchupMatrix:
+    """Winrate of each variant (row) against each opponent (column); NaN where there's no result."""
+
+    def __init__(self, opponents, variants=(), weights=None):
+        # An opponent listed twice is one column with both weights
+        columns = {}
+        for opponent, weight in zip(opponents, weights if weights is not None else [1.0] * len(opponents)):
+            columns[opponent] = columns.get(opponent, 0.0) + weight
+        self.opponents = list(columns)
+        self.weights = np.array(list(columns.values()), dtype=float)
+        self.variants = []
+        self._rows = {}
+        self._columns = {opponent: i for i, opponent in enumerate(self.opponents)}
+        self.winrates = np.full((0, len(self.opponents)), np.nan)
+        self.filled = np.zeros((0, len(self.opponents)), dtype=bool)  # simulated, even if it failed
+        # Running weighted row sums keep means cheap while results stream in
+        self._sums = np.zeros(0)
+        self._counts = np.zeros(0)  # total weight of the opponents with a result
+        self.add_variants(variants)
+
+    def add_variants(self, variants):
+        new = [variant for variant in dict.fromkeys(variants) if variant not in self._rows]
+        for variant in new:
+            self._rows[variant] = len(self.variants)
+            self.variants.append(variant)
+        if new:
+            self.winrates = np.vstack([self.winrates, np.full((len(new), len(self.opponents)), np.nan)])
+            self.filled = np.vstack([self.filled, np.zeros((len(new), len(self.opponents)), dtype=bool)])
+            self._sums = np.concatenate([self._sums, np.zeros(len(new))])
+            self._counts = np.concatenate([self._counts, np.zeros(len(new))])
+
+    def set(self, variant, opponent, winrate):
+        row, column = self._rows[variant], self._columns[opponent]
+        weight = self.weights[column]
+        if self.filled[row, column] and not np.isnan(self.winrates[row, column]):
+            self._sums[row] -= weight * self.winrates[row, column]
+            self._counts[row] -= weight
+        self.filled[row, column] = True
+        self.winrates[row, column] = np.nan if winrate is None else winrate
+        if winrate is not None:
+            self._sums[row] += weight * winrate
+            self._counts[row] += weight
+
+    def missing(self, variants):
+        """(variant, opponent) cells of `variants` that haven't been simulated yet."""
+        rows = [self._rows[variant] for variant in dict.fromkeys(variants)]
+        missing_rows, missing_columns = np.nonzero(~self.filled[rows])
+        return [(self.variants[rows[row]], self.opponents[column]) for row, column in zip(missing_rows, missing_columns)]
+
+    def row_means(self, variants=None):
+        """Weighted mean winrate of each variant over the opponents with results (NaN if none)."""
+        rows = [self._rows[variant] for variant in variants] if variants is not None else slice(None)
+        sums, counts = self._sums[rows], self._counts[rows]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    def means(self, variants) -> Dict[str, Optional[float]]:
+        """Like row_means, as a dict with None for variants without results."""
+        return dict(zip(variants, _to_optional(self.row_means(variants))))
+
+    def deltas(self, baseline, variants) -> Dict[str, Optional[float]]:
+        """Each variant's mean minus the baseline's; None where either has no result."""
+        differences = self.row_means(variants) - self.row_means([baseline])[0]
+        return dict(zip(variants, _to_optional(differences)))
+
+
+def _to_optional(values):
+    return [None if np.isnan(value) else float(value) for value in values]
+
+
+class MatchupPlanner:
+    """Fills a MatchupMatrix for one set of opponents and simulation settings."""
+
+    def __init__(self, opponents, deck_type, battle_type, numb_sims, BGE, tower_type, precision=None, weights=None):
+        self.matrix = MatchupMatrix(opponents, weights=weights)
+        self.deck_type = deck_type
+        self.settings = (battle_type, numb_sims, BGE, tower_type, precision)
+        self._requested = []
+
+    def request(self, variants):
+        """Ask for every opponent's winrate against `variants`; run() simulates them."""
+        variants = list(variants)
+        self.matrix.add_variants(variants)
+        self._requested.extend(variants)
+        return variants
+
+    async def run(self, on_update=None, watch=None):
+        """Simulate every requested cell that's still missing, all in one batch.
+
+        For Offence the variants attack, for Defence the opponents attack them.
+        `on_update(winrates, done, total)` gets the running means of the
+        `watch` variants (default: all requested) as cells finish.
+        """
+        requested, self._requested = list(dict.fromkeys(self._requested)), []
+        watch = list(dict.fromkeys(watch)) if watch is not None else requested
+        cells = self.matrix.missing(requested)
+        if not cells:
+            return self.matrix
+
+        if self.deck_type == "Defence":
+            pairs = [(opponent, variant) for variant, opponent in cells]
+            candidates = "defense"
+        else:
+            pairs = cells
+            candidates = "attack"
+
+        # The early stop on a decided ranking compares the same weighted means as the matrix
+        opponent_weights = dict(zip(self.matrix.opponents, self.matrix.weights.tolist()))
+        done = 0
+        async for attack_deck, defense_deck, winrate in stream_pairs(pairs, *self.settings, candidates=candidates,
+                                                                     opponent_weights=opponent_weights):
+            if self.deck_type == "Defence":
+                self.matrix.set(defense_deck, attack_deck, winrate)
+            else:
+                self.matrix.set(attack_deck, defense_deck, winrate)
+            done += 1
+            if on_update is not None:
+                on_update(self.matrix.means(watch), done, len(cells))
+        return self.matrix
+
+
+def combined_means(matrices, variants, weights=None) -> Dict[str, Optional[float]]:
+    """Weighted mean over several matrices (e.g. one per tower) of each variant's row mean.
+
+    A matrix without any result for a variant is left out of that variant's mean.
+    """
+    means = np.array([matrix.row_means(variants) for matrix in matrices]).reshape(len(matrices), len(variants))
+    weights = np.array(weights if weights is not None else [1.0] * len(matrices), dtype=float)[:, None]
+    have = ~np.isnan(means)
+    totals = (np.where(have, means, 0.0) * weights).sum(axis=0)
+    weight_sums = (have * weights).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return dict(zip(variants, _to_optional(np.where(weight_sums > 0, totals / weight_sums, np.nan))))
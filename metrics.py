@@ -0,0 +1,158 @@
+"""Timings and failure counts for the simulation hot path.
+
+Code wraps the slow steps in spans (browser launch, page navigation,
+waiting for #winrate, JS evaluation, whole simulations) and counts
+retries and failures by cause. Everything is kept in memory for the
+app's metrics panel and can also be exported:
+
+- SPELLSTONE_METRICS_FILE: append every span and count as a JSON line.
+- SPELLSTONE_METRICS_PORT: serve the totals in Prometheus text format
+  on http://127.0.0.1:<port>/metrics.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bounds (seconds) of the span duration histogram buckets
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class SpanStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, seconds, error):
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        # Cumulative, like Prometheus buckets: a duration counts in every bucket it fits
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Metrics:
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._spans = {}  # (name, labels) -> SpanStats
+        self._counters = {}  # (name, labels) -> count
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the block. A block that raises is counted as an error, and the error is re-raised."""
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self._spans.setdefault((name, _label_key(labels)), SpanStats()).add(seconds, error)
+            self._export({"type": "span", "name": name, "labels": labels, "seconds": round(seconds, 4), "error": error})
+
+    def count(self, name, amount=1, **labels):
+        """Add to a counter, e.g. count("navigation_retries", cause="TimeoutError")."""
+        with self._lock:
+            key = (name, _label_key(labels))
+            self._counters[key] = self._counters.get(key, 0) + amount
+        self._export({"type": "count", "name": name, "labels": labels, "amount": amount})
+
+    def _export(self, event):
+        if self.path is None:
+            return
+        event["time"] = round(time.time(), 3)
+        line = json.dumps(event) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+
+    def spans(self):
+        """[(name, labels, SpanStats)] for every span seen so far."""
+        with self._lock:
+            return [(name, dict(labels), stats) for (name, labels), stats in sorted(self._spans.items())]
+
+    def counters(self):
+        """[(name, labels, count)] for every counter seen so far."""
+        with self._lock:
+            return [(name, dict(labels), value) for (name, labels), value in sorted(self._counters.items())]
+
+    def reset(self):
+        """Forget every span and count so far, e.g. between benchmark runs. Exports are unaffected."""
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+    def prometheus_text(self):
+        lines = []
+        for name, labels, stats in self.spans():
+            metric = f"spellstone_{name}_seconds"
+            for bound, in_bucket in zip(BUCKETS, stats.buckets):
+                lines.append(f"{metric}_bucket{_labels(labels, le=bound)} {in_bucket}")
+            lines.append(f"{metric}_bucket{_labels(labels, le='+Inf')} {stats.count}")
+            lines.append(f"{metric}_sum{_labels(labels)} {stats.total:.6f}")
+            lines.append(f"{metric}_count{_labels(labels)} {stats.count}")
+            lines.append(f"spellstone_{name}_errors_total{_labels(labels)} {stats.errors}")
+        for name, labels, value in self.counters():
+            lines.append(f"spellstone_{name}_total{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def serve_prometheus(metrics, port):
+    """Serve metrics.prometheus_text() on localhost from a background thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """The process-wide metrics, exported as configured by SPELLSTONE_METRICS_FILE / SPELLSTONE_METRICS_PORT."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics(os.environ.get("SPELLSTONE_METRICS_FILE"))
+            if os.environ.get("SPELLSTONE_METRICS_PORT"):
+                serve_prometheus(_metrics, int(os.environ["SPELLSTONE_METRICS_PORT"]))
+    return _metrics
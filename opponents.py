@@ -0,0 +1,93 @@
+"""Opponent lists: parse, normalize, dedupe and cluster deck hashes.
+
+Every opponent costs one matchup per candidate deck, so the same deck
+pasted twice, or with its cards in another order, is simulated once
+and counted twice through its weight. Clustering goes further and lets
+one deck stand in for others that differ from it by a few cards.
+"""
+import math
+from collections import Counter
+from typing import List, NamedTuple
+
+from deck_hash import split_units
+
+
+class OpponentSet(NamedTuple):
+    decks: List[str]
+    weights: List[float]  # how many of the imported decks each one stands for
+    errors: List[str] = []  # lines that weren't a deck hash
+
+    @property
+    def total_weight(self):
+        return sum(self.weights)
+
+
+def normalize(deck_hash):
+    """Canonical form of a hash: units validated, cards sorted.
+
+    The sims play cards in random order, so the order in the hash doesn't matter.
+    """
+    units = split_units(deck_hash.strip())
+    if len(units) < 2:
+        raise ValueError(f"Deck hash needs a hero and at least one card: {deck_hash!r}")
+    return units[0] + "".join(sorted(units[1:]))
+
+
+def parse_opponents(text):
+    """Read one deck per line, optionally followed by a weight ("hash 3" or "hash,3").
+
+    Blank lines and lines starting with # are skipped; a weight must be a positive
+    number. Returns a deduped OpponentSet.
+    """
+    decks, weights, errors = [], [], []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = line.replace(",", " ").replace(";", " ").split()
+        try:
+            weight = float(fields[1]) if len(fields) > 1 else 1.0
+            if not math.isfinite(weight) or weight <= 0:
+                raise ValueError(f"Weight must be a positive number: {fields[1]!r}")
+            decks.append(normalize(fields[0]))
+        except ValueError:
+            errors.append(line)
+            continue
+        weights.append(weight)
+    return dedupe(decks, weights, errors)
+
+
+def dedupe(decks, weights=None, errors=()):
+    """Merge identical decks (after normalization), adding up their weights."""
+    merged = {}
+    for deck, weight in zip(decks, weights if weights is not None else [1.0] * len(decks)):
+        deck = normalize(deck)
+        merged[deck] = merged.get(deck, 0.0) + weight
+    return OpponentSet(list(merged), list(merged.values()), list(errors))
+
+
+def deck_distance(deck_hash, other_hash):
+    """Cards that would have to be swapped to turn one deck into the other; a different hero counts as one."""
+    units, other_units = split_units(deck_hash), split_units(other_hash)
+    cards, other_cards = Counter(units[1:]), Counter(other_units[1:])
+    swaps = max(sum((cards - other_cards).values()), sum((other_cards - cards).values()))
+    return swaps + (units[0] != other_units[0])
+
+
+def cluster(opponents, max_distance=1):
+    """Fold decks into a heavier deck at most `max_distance` swaps away.
+
+    Greedy: the heaviest decks become representatives first and every
+    other deck joins the first representative close enough to it.
+    """
+    order = sorted(range(len(opponents.decks)), key=lambda i: opponents.weights[i], reverse=True)
+    representatives = {}
+    for i in order:
+        deck = opponents.decks[i]
+        for representative in representatives:
+            if deck_distance(deck, representative) <= max_distance:
+                representatives[representative] += opponents.weights[i]
+                break
+        else:
+            representatives[deck] = opponents.weights[i]
+    return OpponentSet(list(representatives), list(representatives.values()), opponents.errors)
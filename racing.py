@@ -0,0 +1,105 @@
+"""Successive halving over candidate decks.
+
+Every candidate gets a cheap first round against all opponents, the
+bottom part of the field is dropped, and the survivors get twice the
+sims in the next round. This repeats until one candidate is clearly
+ahead or the survivors reach the full sim count.
+"""
+import math
+from typing import Dict, NamedTuple, Optional
+
+from result_cache import get_cache, merge_results
+from sampling import mean_interval, ranking_decided
+from simulator import cached_result, stream_pairs
+
+
+FIRST_ROUND_SIMS = 500
+KEEP_FRACTION = 0.5
+
+
+class RaceResult(NamedTuple):
+    winrates: Dict[str, Optional[float]]  # candidate -> average winrate, in input order (None if every sim failed)
+    eliminated: Dict[str, Optional[int]]  # candidate -> round it was dropped in (None = survived)
+    sims_used: int  # sims this race ran; cached results cost nothing
+    sims_budget: int  # what running every candidate to the full sim count would have cost
+
+    @property
+    def saved(self):
+        return 1 - self.sims_used / self.sims_budget if self.sims_budget else 0.0
+
+
+async def race(candidates, opponents, deck_type, battle_type, numb_sims, BGE, tower_type,
+               first_round_sims=FIRST_ROUND_SIMS, keep_fraction=KEEP_FRACTION, on_update=None, weights=None):
+    """Find the best of `candidates` against `opponents` without simulating them all in full.
+
+    For Offence the candidates attack and a high winrate is good; for
+    Defence the opponents attack and a low winrate is good. Averages
+    over the opponents use `weights` if given.
+    `on_update(winrates, done, total)` is called after every finished matchup.
+
+    Each round is one batch of pairs, so big machines shard it over
+    several browsers (see sharding.py). Rounds top up the earlier rounds'
+    sims through the result cache; with the cache off a round's sims are
+    run afresh and merged with the earlier ones.
+    """
+    # An opponent listed twice is simulated once with both weights
+    opponent_weights = {}
+    for opponent, weight in zip(opponents, weights if weights is not None else [1.0] * len(opponents)):
+        opponent_weights[opponent] = opponent_weights.get(opponent, 0.0) + weight
+    opponents = list(opponent_weights)
+    weights = list(opponent_weights.values())
+    candidates = list(dict.fromkeys(candidates))
+    numb_sims = int(numb_sims)
+    sign = 1 if deck_type == "Offence" else -1
+    results = {(candidate, opponent): None for candidate in candidates for opponent in opponents}
+    eliminated = dict.fromkeys(candidates)
+    survivors = list(candidates)
+    sims = min(first_round_sims, numb_sims)
+    round_number = 0
+    sims_used = 0
+    use_cache = get_cache() is not None
+
+    def matchup(candidate, opponent):
+        return (candidate, opponent) if deck_type == "Offence" else (opponent, candidate)
+
+    while True:
+        pairs = {matchup(candidate, opponent): (candidate, opponent) for candidate in survivors for opponent in opponents}
+        # What the cache held before the round, to count only the sims this race runs
+        before = {pair: cached_result(*pair, battle_type, BGE, tower_type) for pair in pairs} if use_cache else {}
+        async for attack_deck, defense_deck, winrate in stream_pairs(list(pairs), battle_type, sims, BGE, tower_type):
+            pair = (attack_deck, defense_deck)
+            prior = results[pairs[pair]]
+            if use_cache:
+                result = cached_result(attack_deck, defense_deck, battle_type, BGE, tower_type) or prior
+                sims_used += (result.sims if result else 0) - (before[pair].sims if before[pair] else 0)
+            else:
+                result = merge_results(prior, winrate, sims) if winrate is not None else prior
+                sims_used += sims
+            results[pairs[pair]] = result
+            if on_update is not None:
+                done = sum(1 for result in results.values() if result is not None)
+                on_update({c: _mean(results, c, opponents, weights, None) for c in candidates}, done, len(results))
+
+        intervals = {candidate: mean_interval([results[candidate, opponent] for opponent in opponents], weights)
+                     for candidate in survivors}
+        if sims >= numb_sims or len(survivors) == 1:
+            break
+        ranked = sorted(survivors, key=lambda candidate: sign * _mean(results, candidate, opponents, weights), reverse=True)
+        if ranking_decided(ranked[0], intervals):
+            break
+        keep = max(1, math.ceil(len(ranked) * keep_fraction))
+        for candidate in ranked[keep:]:
+            eliminated[candidate] = round_number
+        survivors = ranked[:keep]
+        round_number += 1
+        sims = min(sims * 2, numb_sims)
+
+    winrates = {candidate: _mean(results, candidate, opponents, weights, None) for candidate in candidates}
+    return RaceResult(winrates, eliminated, sims_used, len(candidates) * len(opponents) * numb_sims)
+
+
+def _mean(results, candidate, opponents, weights, default=0.0):
+    pairs = [(weight, results[candidate, opponent].winrate) for opponent, weight in zip(opponents, weights)
+             if results[candidate, opponent] is not None]
+    total = sum(weight for weight, _ in pairs)
+    return sum(weight * winrate for weight, winrate in pairs) / total if total else default
@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+
+CACHE_FILE = os.environ.get(
+    "SPELLSTONE_CACHE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "results_cache.sqlite"))
+DEFAULT_MAX_ENTRIES = 200000
+DEFAULT_TTL_DAYS = 7  # SIMSpellstone's card data changes with game updates
+EVICT_EVERY = 1000  # inserts between eviction passes
+
+
+class CachedResult(NamedTuple):
+    winrate: float  # percent
+    sims: int
+
+
+def merge_results(prior, winrate, sims):
+    """Combine a previous CachedResult (or None) with `sims` new fights at `winrate`."""
+    if prior is None:
+        return CachedResult(winrate, sims)
+    total = prior.sims + sims
+    return CachedResult((prior.winrate * prior.sims + winrate * sims) / total, total)
+
+
+def cache_key(params, backend_id):
+    """Everything that goes into the Titans.html URL except the number of sims, plus which simulator ran it.
+
+    `backend_id` keeps mock results and other simulator versions apart from the real site's.
+    """
+    matchup = {key: value for key, value in params.items() if key != "sims"}
+    return json.dumps({"backend": backend_id, **matchup}, sort_keys=True)
+
+
+class ResultCache:
+    """Simulated winrates on disk, with LRU eviction past `max_entries` and a TTL.
+
+    Results for the same matchup are merged, so every sim ever run for it
+    counts towards the estimate.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_entries=DEFAULT_MAX_ENTRIES, ttl_days=DEFAULT_TTL_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self._adds_since_evict = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, winrate REAL NOT NULL, sims INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT winrate, sims FROM results WHERE key = ? AND created > ?", (key, now - self.ttl)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return CachedResult(*row)
+
+    def add(self, key, winrate, sims):
+        """Merge `sims` new fights at `winrate` into the entry and return the combined result."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT winrate, sims, created FROM results WHERE key = ? AND created > ?",
+                (key, now - self.ttl)).fetchone()
+            prior, created = None, now
+            if row is not None:
+                prior, created = CachedResult(row[0], row[1]), row[2]
+            result = merge_results(prior, winrate, sims)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, winrate, sims, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, result.winrate, result.sims, created, now))
+            self._conn.commit()
+            self._adds_since_evict += 1
+        if self._adds_since_evict >= EVICT_EVERY:
+            self.evict()
+        return result
+
+    def evict(self):
+        with self._lock:
+            self._adds_since_evict = 0
+            self._conn.execute("DELETE FROM results WHERE created <= ?", (time.time() - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                " SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide cache, or None when disabled with SPELLSTONE_CACHE=0."""
+    global _cache
+    if os.environ.get("SPELLSTONE_CACHE", "1") == "0":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(
+                max_entries=int(os.environ.get("SPELLSTONE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                ttl_days=float(os.environ.get("SPELLSTONE_CACHE_TTL_DAYS", DEFAULT_TTL_DAYS)))
+    return _cache
@@ -0,0 +1,48 @@
+import math
+
+
+Z_95 = 1.96
+DEFAULT_CHUNK = 500  # sims per adaptive step
+
+
+def wilson_interval(winrate, sims, z=Z_95):
+    """95% Wilson score interval for a winrate (in percent) measured over `sims` fights."""
+    if not sims:
+        return 0.0, 100.0
+    p = winrate / 100
+    denominator = 1 + z * z / sims
+    centre = (p + z * z / (2 * sims)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / sims + z * z / (4 * sims * sims)) / denominator
+    return max(0.0, centre - margin) * 100, min(1.0, centre + margin) * 100
+
+
+def half_width(result):
+    """Half the width of the interval around a CachedResult, in percentage points."""
+    if result is None:
+        return 50.0
+    low, high = wilson_interval(result.winrate, result.sims)
+    return (high - low) / 2
+
+
+def mean_interval(results, weights=None):
+    """Conservative interval for the (weighted) average winrate over several matchups.
+
+    Matchups without a result yet count as anywhere between 0 and 100%.
+    """
+    if not results:
+        return 0.0, 100.0
+    weights = weights if weights is not None else [1.0] * len(results)
+    lows, highs = zip(*(wilson_interval(r.winrate, r.sims) if r is not None else (0.0, 100.0) for r in results))
+    total = sum(weights)
+    if not total:
+        return 0.0, 100.0
+    return (sum(w * low for w, low in zip(weights, lows)) / total,
+            sum(w * high for w, high in zip(weights, highs)) / total)
+
+
+def ranking_decided(candidate, intervals):
+    """True once `candidate`'s interval no longer overlaps any other candidate's."""
+    low, high = intervals[candidate]
+    return len(intervals) > 1 and all(
+        other_high < low or other_low > high
+        for other, (other_low, other_high) in intervals.items() if other != candidate)
@@ -0,0 +1,204 @@
+"""Spread deck pairs over several worker processes, each with its own browser.
+
+Pairs are split into one shard per worker. A worker that runs out of
+pairs steals from the tail of the longest remaining shard, so one slow
+matchup never holds up the rest of the batch.
+
+`python sharding.py` is a smoke run of the whole sharded path on the mock
+backend: two workers, a small batch, every pair must come back.
+"""
+import asyncio
+import atexit
+import math
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.managers import BaseManager
+
+
+BROWSER_MEMORY_MB = 400  # Chromium's own processes
+PAGE_MEMORY_MB = 150  # one renderer running the simulator
+MEMORY_SHARE = 0.5  # never plan to use more than this share of RAM
+PAGES_PER_WORKER = 4
+RESULT_POLL_INTERVAL = 1.0  # seconds between checks that the workers are still alive
+
+
+class StealingQueues:
+    """Task indices split into shards; lives in the manager process so every worker sees it."""
+
+    def __init__(self, n_tasks, n_shards):
+        self._lock = threading.Lock()
+        size = math.ceil(n_tasks / n_shards) if n_shards else n_tasks
+        self._shards = [deque(range(start, min(start + size, n_tasks))) for start in range(0, n_tasks, size or 1)]
+        self._shards += [deque() for _ in range(n_shards - len(self._shards))]
+
+    def take(self, shard):
+        """Next task for `shard`, stolen from the fullest other shard once its own is empty."""
+        with self._lock:
+            if self._shards[shard]:
+                return self._shards[shard].popleft()
+            victim = max(self._shards, key=len)
+            if victim:
+                return victim.pop()
+            return None
+
+
+class _Manager(BaseManager):
+    pass
+
+
+_Manager.register("StealingQueues", StealingQueues)
+_Manager.register("Queue", queue.Queue)
+_Manager.register("Event", threading.Event)
+
+
+def _total_memory_mb():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20
+    except (AttributeError, ValueError, OSError):
+        return 4096  # Not available on Windows, assume a small machine
+
+
+def auto_size(cpus=None, memory_mb=None):
+    """(workers, pages per worker) that fit this machine's CPUs and memory."""
+    cpus = cpus or os.cpu_count() or 1
+    memory_mb = memory_mb or _total_memory_mb()
+    workers = max(1, cpus // PAGES_PER_WORKER)
+    pages = max(1, cpus // workers)
+    budget = memory_mb * MEMORY_SHARE
+    while pages > 1 and workers * (BROWSER_MEMORY_MB + pages * PAGE_MEMORY_MB) > budget:
+        pages -= 1
+    while workers > 1 and workers * (BROWSER_MEMORY_MB + pages * PAGE_MEMORY_MB) > budget:
+        workers -= 1
+    return workers, pages
+
+
+def _init_worker(pages):
+    # Read by browser_pool.get_pool() when the worker's pool is first created
+    os.environ["SPELLSTONE_POOL_SIZE"] = str(pages)
+    # Only the main process serves /metrics; workers still write to SPELLSTONE_METRICS_FILE
+    os.environ.pop("SPELLSTONE_METRICS_PORT", None)
+
+
+def _run_shard(shard, queues, tasks, settings, pages, finished, stop):
+    asyncio.run(_shard_main(shard, queues, tasks, settings, pages, finished, stop))
+
+
+async def _shard_main(shard, queues, tasks, settings, pages, finished, stop):
+    from simulator import run_simulation, run_simulation_adaptive
+
+    battle_type, numb_sims, BGE, tower_type, precision = settings
+
+    async def consume():
+        while not stop.is_set():
+            index = await asyncio.to_thread(queues.take, shard)
+            if index is None:
+                return
+            attack_deck, defense_deck = tasks[index]
+            if precision is None:
+                winrate = await run_simulation(attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type)
+            else:
+                result = await run_simulation_adaptive(
+                    attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type, precision)
+                winrate = result.winrate if result is not None else None
+            await asyncio.to_thread(finished.put, (index, winrate))
+
+    await asyncio.gather(*(consume() for _ in range(pages)))
+
+
+class ShardScheduler:
+    """Long-lived worker processes; browsers stay warm between batches."""
+
+    def __init__(self, workers, pages):
+        self.workers = workers
+        self.pages = pages
+        context = get_context("spawn")  # Playwright doesn't survive a fork
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(pages,))
+        self._manager = _Manager(ctx=context)
+        self._manager.start()
+
+    async def run(self, deck_pairs, battle_type, numb_sims, BGE, tower_type, precision=None, pbar=None, on_result=None):
+        """Winrate for every pair, in the same order as `deck_pairs`.
+
+        `on_result(index, winrate)` is called as each pair finishes.
+        With `precision` each pair is simulated adaptively; stopping on a
+        decided ranking needs shared state and only happens in-process.
+        """
+        queues = self._manager.StealingQueues(len(deck_pairs), self.workers)
+        finished = self._manager.Queue()
+        stop = self._manager.Event()
+        settings = (battle_type, numb_sims, BGE, tower_type, precision)
+        futures = [self._executor.submit(_run_shard, shard, queues, deck_pairs, settings, self.pages, finished, stop)
+                   for shard in range(self.workers)]
+        winrates = [None] * len(deck_pairs)
+        received = 0
+        try:
+            while received < len(deck_pairs):
+                try:
+                    index, winrate = await asyncio.to_thread(finished.get, True, RESULT_POLL_INTERVAL)
+                except queue.Empty:
+                    if all(future.done() for future in futures):
+                        for future in futures:
+                            future.result()  # Re-raise a crashed worker's error
+                        break
+                    continue
+                winrates[index] = winrate
+                received += 1
+                if pbar is not None:
+                    pbar.update(1)
+                if on_result is not None:
+                    on_result(index, winrate)
+        finally:
+            # Cancelled or failed: let the workers finish their current pair and stop
+            stop.set()
+        return winrates
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+        self._manager.shutdown()
+
+
+_scheduler = None
+_scheduler_sized = False
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide scheduler, or None when one worker is all we'd get.
+
+    SPELLSTONE_WORKERS and SPELLSTONE_PAGES_PER_WORKER override the automatic sizing.
+    """
+    global _scheduler, _scheduler_sized
+    with _scheduler_lock:
+        if not _scheduler_sized:
+            _scheduler_sized = True
+            workers, pages = auto_size()
+            workers = int(os.environ.get("SPELLSTONE_WORKERS", workers))
+            pages = int(os.environ.get("SPELLSTONE_PAGES_PER_WORKER", pages))
+            if workers > 1:
+                _scheduler = ShardScheduler(workers, pages)
+                atexit.register(_scheduler.close)
+    return _scheduler
+
+
+def smoke_run(workers=2, pages=2, n_pairs=12):
+    """Run a small batch through real worker processes on the mock backend; raises if any pair is lost."""
+    os.environ["SPELLSTONE_BACKEND"] = "mock"  # The spawned workers inherit it
+    os.environ["SPELLSTONE_CACHE"] = "0"
+    deck_pairs = [(f"attack{i}", f"defense{i}") for i in range(n_pairs)]
+    scheduler = ShardScheduler(workers, pages)
+    try:
+        winrates = asyncio.run(scheduler.run(deck_pairs, "Tower Battles", 100, "BDCD", "501"))
+    finally:
+        scheduler.close()
+    if len(winrates) != n_pairs or any(winrate is None for winrate in winrates):
+        raise RuntimeError(f"Sharded smoke run lost pairs: {winrates}")
+    return winrates
+
+
+if __name__ == "__main__":
+    print(f"{len(smoke_run())} pairs simulated over 2 workers")
@@ -0,0 +1,227 @@
+import asyncio
+from collections import defaultdict
+
+from tqdm.asyncio import tqdm
+
+from backends import get_backend
+from metrics import get_metrics
+from result_cache import cache_key, get_cache, merge_results
+from sampling import DEFAULT_CHUNK, half_width, ranking_decided, wilson_interval
+from sharding import get_scheduler
+
+
+def simulation_params(attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type):
+    """Query parameters for one matchup, in the order Titans.html expects them."""
+    params = {"deck1": attack_deck, "deck2": defense_deck, "mission_level": 7, "raid_level": 25}
+    if battle_type == "Tower Battles":
+        params.update({"siege": True, "tower_level": 18, "tower_type": tower_type, "bges": BGE})
+    elif battle_type == "Arena":
+        params["bges"] = BGE + "JI"
+    params["sims"] = numb_sims
+    return params
+
+
+def parse_winrate(text):
+    """'55.23%' -> 55.23, None if the page didn't give us a number."""
+    try:
+        return float(text.strip().strip('%'))
+    except (AttributeError, ValueError):
+        return None
+
+
+async def run_simulation(attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type):
+    """Winrate of attack_deck vs defense_deck in percent, or None if the sim failed.
+
+    Cached results are reused; if the cache holds fewer than `numb_sims`
+    fights for this matchup only the missing ones are simulated and merged in.
+    """
+    result = await run_simulation_result(attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type)
+    return result.winrate if result is not None else None
+
+
+async def run_simulation_result(attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type):
+    """Like run_simulation, but returns a CachedResult with the sims behind the winrate."""
+    numb_sims = int(numb_sims)
+    params = simulation_params(attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type)
+    key = cache_key(params, get_backend().cache_id)
+    cache = get_cache()
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None and cached.sims >= numb_sims:
+        return cached
+    missing = numb_sims - (cached.sims if cached is not None else 0)
+    return await _extend(params, key, cached, missing)
+
+
+def cached_result(attack_deck, defense_deck, battle_type, BGE, tower_type):
+    """Every sim cached for this matchup as a CachedResult, None if there are none (or no cache)."""
+    cache = get_cache()
+    if cache is None:
+        return None
+    params = simulation_params(attack_deck, defense_deck, battle_type, 1, BGE, tower_type)
+    return cache.get(cache_key(params, get_backend().cache_id))
+
+
+async def run_simulation_adaptive(attack_deck, defense_deck, battle_type, max_sims, BGE, tower_type, precision,
+                                  chunk=DEFAULT_CHUNK, is_decided=None):
+    """Simulate in chunks until the winrate is known to +-`precision` percentage points.
+
+    Also stops at `max_sims`, or as soon as `is_decided()` says the answer no
+    longer matters. Returns a CachedResult, or None if nothing could be simulated.
+    """
+    max_sims = max(int(max_sims), 1)
+    params = simulation_params(attack_deck, defense_deck, battle_type, chunk, BGE, tower_type)
+    key = cache_key(params, get_backend().cache_id)
+    cache = get_cache()
+    result = cache.get(key) if cache is not None else None
+    while result is None or (result.sims < max_sims and half_width(result) > precision):
+        if result is not None and is_decided is not None and is_decided():
+            break
+        extended = await _extend(params, key, result, min(chunk, max_sims - (result.sims if result else 0)))
+        if extended is result:
+            break  # The sim failed, don't keep hammering the page
+        result = extended
+    return result
+
+
+async def _extend(params, key, prior, extra_sims):
+    """Run `extra_sims` more fights and merge them into `prior` (and the cache)."""
+    params = dict(params, sims=extra_sims)
+    metrics = get_metrics()
+    with metrics.span("simulation"):
+        text = await get_backend().simulate(params)
+    winrate = parse_winrate(text)
+    if winrate is None:
+        # The cause (navigation, page error, ...) is counted where it happened
+        metrics.count("simulation_failures", cause="no_result" if text is None else "unparseable_winrate")
+        # A less precise answer beats none at all
+        return prior
+    cache = get_cache()
+    if cache is not None:
+        return cache.add(key, winrate, extra_sims)
+    return merge_results(prior, winrate, extra_sims)
+
+
+async def simulate_pair(pair, battle_type, numb_sims, BGE, tower_type, pbar, on_result=None):
+    # Concurrency is bounded by the backend (the number of pages in the pool)
+    attack_deck, defense_deck = pair
+    result = await run_simulation(attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type)
+    pbar.update(1)
+    if on_result is not None:
+        on_result((attack_deck, defense_deck, result))
+    return (attack_deck, defense_deck, result)
+
+
+async def run_pairs_parallel(deck_pairs, battle_type, numb_sims, BGE, tower_type,
+                             precision=None, candidates=None, on_result=None, opponent_weights=None):
+    """Simulate each (attack deck, defense deck) pair.
+
+    Big machines shard the pairs over several worker processes (see sharding.py).
+    With `precision` set each matchup is simulated adaptively (see
+    run_simulation_adaptive) with `numb_sims` as the upper limit.
+    `candidates` ("attack" or "defense") names the side being compared;
+    a candidate's matchups stop early once its place in the ranking can't change,
+    judged on its mean over the opponents weighted by `opponent_weights`
+    (opponent deck -> weight, default 1 each).
+    `on_result` is called with each (attack, defense, winrate) as soon as it's done,
+    possibly from another thread.
+    """
+    total_simulations = len(deck_pairs)
+
+    # Spread big batches over several browsers when the machine has the cores for it.
+    # The ranking-based early stop needs every result in one place, so that stays in-process.
+    scheduler = get_scheduler()
+    if scheduler is not None and (precision is None or candidates is None):
+        def on_index(index, winrate):
+            if on_result is not None:
+                on_result(deck_pairs[index] + (winrate,))
+
+        with tqdm(total=total_simulations, desc="Simulations Progress", unit="sim") as pbar:
+            winrates = await scheduler.run(deck_pairs, battle_type, numb_sims, BGE, tower_type, precision, pbar, on_index)
+        return [(attack_deck, defense_deck, winrate) for (attack_deck, defense_deck), winrate in zip(deck_pairs, winrates)]
+
+    backend = get_backend()
+    if precision is None:
+        async def run_all():
+            with tqdm(total=total_simulations, desc="Simulations Progress", unit="sim") as pbar:
+                tasks = [simulate_pair(pair, battle_type, numb_sims, BGE, tower_type, pbar, on_result) for pair in deck_pairs]
+                return await asyncio.gather(*tasks)
+
+        return await backend.run(run_all())
+
+    side = {"attack": 0, "defense": 1}.get(candidates)
+    results = dict.fromkeys(deck_pairs)
+    # Weighted interval sums per candidate, as in mean_interval, kept up to date as pairs
+    # finish so a ranking check costs one pass over the candidates instead of the whole batch
+    bounds = defaultdict(lambda: [0.0, 0.0, 0.0])  # candidate -> [weight, weighted lows, weighted highs]
+    intervals = {}
+
+    def weight(pair):
+        return opponent_weights.get(pair[1 - side], 1.0) if opponent_weights else 1.0
+
+    def record(pair, result):
+        candidate = pair[side]
+        old_low, old_high = (0.0, 100.0) if results[pair] is None else wilson_interval(results[pair].winrate, results[pair].sims)
+        new_low, new_high = (0.0, 100.0) if result is None else wilson_interval(result.winrate, result.sims)
+        results[pair] = result
+        total = bounds[candidate]
+        total[1] += weight(pair) * (new_low - old_low)
+        total[2] += weight(pair) * (new_high - old_high)
+        intervals[candidate] = (total[1] / total[0], total[2] / total[0]) if total[0] else (0.0, 100.0)
+
+    if side is not None:
+        for pair in results:
+            bounds[pair[side]][0] += weight(pair)
+            bounds[pair[side]][2] += weight(pair) * 100.0
+        for candidate, (total, lows, highs) in bounds.items():
+            intervals[candidate] = (lows / total, highs / total) if total else (0.0, 100.0)
+
+    async def simulate_adaptive(pair, pbar):
+        attack_deck, defense_deck = pair
+        is_decided = (lambda: ranking_decided(pair[side], intervals)) if side is not None else None
+        result = await run_simulation_adaptive(
+            attack_deck, defense_deck, battle_type, numb_sims, BGE, tower_type, precision, is_decided=is_decided)
+        if side is not None:
+            record(pair, result)
+        else:
+            results[pair] = result
+        pbar.update(1)
+        row = (attack_deck, defense_deck, result.winrate if result is not None else None)
+        if on_result is not None:
+            on_result(row)
+        return row
+
+    async def run_all_adaptive():
+        with tqdm(total=total_simulations, desc="Simulations Progress", unit="sim") as pbar:
+            return await asyncio.gather(*(simulate_adaptive(pair, pbar) for pair in deck_pairs))
+
+    return await backend.run(run_all_adaptive())
+
+
+async def stream_pairs(deck_pairs, battle_type, numb_sims, BGE, tower_type, precision=None, candidates=None,
+                       opponent_weights=None):
+    """Yield (attack, defense, winrate) for each pair as soon as it finishes.
+
+    Takes the same arguments as run_pairs_parallel. Closing the generator
+    early (or cancelling the task consuming it) cancels the matchups still running.
+    """
+    loop = asyncio.get_running_loop()
+    finished = asyncio.Queue()
+
+    def on_result(row):
+        loop.call_soon_threadsafe(finished.put_nowait, row)
+
+    batch = asyncio.ensure_future(run_pairs_parallel(
+        deck_pairs, battle_type, numb_sims, BGE, tower_type, precision, candidates, on_result, opponent_weights))
+    try:
+        for _ in range(len(deck_pairs)):
+            next_row = asyncio.ensure_future(finished.get())
+            await asyncio.wait({next_row, batch}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_row.done():
+                next_row.cancel()
+                batch.result()  # Re-raise whatever stopped the batch
+                if finished.empty():
+                    return
+                next_row = asyncio.ensure_future(finished.get())
+            yield await next_row
+    finally:
+        batch.cancel()
@@ -0,0 +1,175 @@
+"""Run the app's optimizations from the command line, without Streamlit.
+
+Examples:
+
+    python standalone.py cards --deck <hash> --opponents opponents.txt -o cards.json
+    python standalone.py hero --deck <hash> --opponents opponents.txt --deck-type Defence -o heroes.csv
+    python standalone.py replacement --deck <hash> --cards <hashes> --opponents opponents.txt -o cards.csv
+    python standalone.py swap --deck <hash> --cards <hashes> --opponents opponents.txt --swap-size 2 --top-k 10
+    python standalone.py hero --deck <hash> --opponents opponents.txt --towers all --bges BDCD,BDBD -o sweep.csv
+
+Opponent files hold one deck hash per line, optionally followed by a weight
+("hash 3"). Duplicates are merged into weights; --merge N also merges decks
+that differ by at most N cards. Results are written as JSON or CSV depending
+on the output file's extension (JSON to stdout without -o).
+
+--towers and --bges sweep cards, hero or replacement over every tower and
+BGE listed, in one batch: each candidate gets a row per config and an
+"overall" row averaging them.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import sys
+
+from deck_hash import addition_variants, hero_variants, removal_variants, split_units
+from engine import (default_bge, find_replacement, find_swaps, get_card_name_from_hash, heroes, load_towers, optimize_deck,
+                    optimize_hero, sweep_configs)
+from opponents import cluster, parse_opponents
+
+
+FIELDS = ["candidate", "rune", "deck", "config", "winrate", "dropped_early", "predicted"]
+
+
+def read_opponents(path, merge_distance=0):
+    with open(path, "r") as f:
+        opponent_set = parse_opponents(f.read())
+    for line in opponent_set.errors:
+        print(f"Skipping {line!r}: not a deck hash", file=sys.stderr)
+    if merge_distance:
+        opponent_set = cluster(opponent_set, merge_distance)
+    return opponent_set
+
+
+def tower_id(value):
+    # Accept a tower name from towers.json as well as its id
+    for tower in load_towers():
+        if value in (tower["id"], tower["name"]):
+            return tower["id"]
+    raise argparse.ArgumentTypeError(f"Unknown tower {value!r}")
+
+
+def tower_ids(value):
+    if value == "all":
+        return [tower["id"] for tower in load_towers()]
+    return [tower_id(name.strip()) for name in value.split(";")]
+
+
+def dropped(race_result, deck):
+    return race_result is not None and race_result.eliminated.get(deck) is not None
+
+
+async def run(args):
+    opponent_set = read_opponents(args.opponents, args.merge)
+    opponents, weights = opponent_set.decks, opponent_set.weights
+    settings = (args.deck_type, args.battle_type, args.sims, args.bge, args.tower, args.precision, args.racing)
+
+    if args.towers or args.bges:
+        return await run_configs(args, opponents, weights)
+    if args.command == "cards":
+        avg_winrate, avg_winrates, names, runes, race_result = await optimize_deck(args.deck, opponents, *settings, weights=weights)
+        rows = [{"candidate": "(current deck)", "rune": "", "deck": args.deck, "winrate": avg_winrate, "dropped_early": False}]
+        for name, rune, (_, deck) in zip(names, runes, removal_variants(args.deck)):
+            rows.append({"candidate": name, "rune": rune, "deck": deck,
+                         "winrate": avg_winrates[deck], "dropped_early": dropped(race_result, deck)})
+    elif args.command == "hero":
+        hero_decks, result = await optimize_hero(args.deck, opponents, *settings, weights=weights)
+        rows = [{"candidate": name, "rune": "", "deck": deck,
+                 "winrate": result.winrates[deck], "dropped_early": dropped(result.race, deck)}
+                for name, deck in hero_decks.items()]
+    elif args.command == "replacement":
+        card_hashes = list(split_units(args.cards))
+        card_info, card_decks, result = await find_replacement(args.deck, card_hashes, opponents, *settings, weights=weights)
+        rows = [{"candidate": card_info[card_hash][0], "rune": card_info[card_hash][1], "deck": deck,
+                 "winrate": result.winrates[deck], "dropped_early": dropped(result.race, deck)}
+                for card_hash, deck in card_decks.items()]
+    elif args.command == "swap":
+        card_hashes = list(split_units(args.cards))
+        swap_result = await find_swaps(args.deck, card_hashes, opponents, *settings, swap_size=args.swap_size, top_k=args.top_k,
+                                       weights=weights)
+        rows = [{"candidate": "(current deck)", "rune": "", "deck": args.deck, "winrate": swap_result.baseline, "dropped_early": False}]
+        for swap in swap_result.swaps:
+            removed = [" ".join(await get_card_name_from_hash(card_hash)) for card_hash in swap.removed]
+            added = [" ".join(await get_card_name_from_hash(card_hash)) for card_hash in swap.added]
+            rows.append({"candidate": f"{' + '.join(removed)} -> {' + '.join(added)}", "rune": "", "deck": swap.deck,
+                         "winrate": swap.winrate, "dropped_early": False, "predicted": swap.estimate})
+    return rows
+
+
+async def run_configs(args, opponents, weights):
+    towers = args.towers or [args.tower]
+    if args.battle_type == "Arena":
+        towers = towers[:1]  # Arena has no tower: every tower would be the same config
+    bges = [bge.strip() for bge in (args.bges or args.bge).split(",") if bge.strip()]
+    configs = [(tower, bge) for tower in towers for bge in bges]
+    if args.command == "cards":
+        candidates = [("(current deck)", "", args.deck)]
+        for card_hash, deck in removal_variants(args.deck):
+            candidates.append((*await get_card_name_from_hash(card_hash), deck))
+    elif args.command == "hero":
+        candidates = [(name, "", deck) for name, deck in zip(heroes, hero_variants(args.deck, heroes.values()))]
+    else:
+        candidates = []
+        for card_hash, deck in addition_variants(args.deck, list(split_units(args.cards))):
+            candidates.append((*await get_card_name_from_hash(card_hash), deck))
+
+    result = await sweep_configs([deck for _, _, deck in candidates], opponents, args.deck_type, args.battle_type, args.sims,
+                                 configs, args.precision, weights=weights)
+    rows = []
+    for name, rune, deck in candidates:
+        for (tower, bge), winrates in zip(result.configs, result.winrates):
+            config = bge if args.battle_type == "Arena" else f"{tower}/{bge}"
+            rows.append({"candidate": name, "rune": rune, "deck": deck, "config": config, "winrate": winrates[deck]})
+        rows.append({"candidate": name, "rune": rune, "deck": deck, "config": "overall", "winrate": result.overall[deck]})
+    return rows
+
+
+def write_rows(rows, output):
+    if output is None:
+        json.dump(rows, sys.stdout, indent=2)
+        print()
+    elif output.endswith(".csv"):
+        with open(output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Spellstone deck optimization without the web UI.")
+    parser.add_argument("command", choices=["cards", "hero", "replacement", "swap"],
+                        help="cards: remove each card, hero: try every hero, replacement: add each candidate card, "
+                             "swap: best swaps of deck cards for candidate cards")
+    parser.add_argument("--deck", required=True, help="Your deck hash (with a free slot for 'replacement')")
+    parser.add_argument("--opponents", required=True, help="File with one opponent deck hash (and optional weight) per line")
+    parser.add_argument("--merge", type=int, default=0, metavar="N", help="Merge opponents that differ by at most N cards")
+    parser.add_argument("--cards", default="", help="Replacement card hashes, concatenated")
+    parser.add_argument("--swap-size", type=int, choices=[1, 2], default=1, help="Cards swapped at once (swap only)")
+    parser.add_argument("--top-k", type=int, default=5, help="Number of swaps to report (swap only)")
+    parser.add_argument("--deck-type", choices=["Offence", "Defence"], default="Offence")
+    parser.add_argument("--battle-type", choices=["Tower Battles", "Arena"], default="Tower Battles")
+    parser.add_argument("--sims", type=int, default=10000, help="Sims per matchup (upper limit with --precision)")
+    parser.add_argument("--bge", default=default_bge)
+    parser.add_argument("--tower", type=tower_id, default="501", help="Tower id or name from towers.json")
+    parser.add_argument("--towers", type=tower_ids, help="Sweep these towers instead of --tower: ids or names separated "
+                                                         "by ';', or 'all'")
+    parser.add_argument("--bges", help="Sweep these BGEs (comma separated) instead of --bge")
+    parser.add_argument("--precision", type=float, help="Stop each matchup once its winrate is known to +- this many %%. "
+                                                        "Runs in one process: SPELLSTONE_WORKERS doesn't apply")
+    parser.add_argument("--racing", action="store_true", help="Drop clearly worse candidates early")
+    parser.add_argument("-o", "--output", help="Output file (.json or .csv)")
+    args = parser.parse_args(argv)
+    if args.command in ("replacement", "swap") and not args.cards:
+        parser.error(f"{args.command} needs --cards")
+    if args.command == "swap" and (args.towers or args.bges):
+        parser.error("swap can't sweep --towers or --bges")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    write_rows(asyncio.run(run(args)), args.output)